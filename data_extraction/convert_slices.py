@@ -0,0 +1,63 @@
+"""Converts pickled npz slices to the memory-mappable npy store."""
+
+import glob
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(sys.argv[0], "../../")))
+import ytscripts.slice_store as slice_store  # noqa: E402
+import ytscripts.ytargs as ytargs  # noqa: E402
+
+
+def get_parser():
+    """Get the parser."""
+    ytparse = ytargs.ytExtractArgs()
+
+    # remove unused arguments from base class
+    ytparse.remove_arg("field")
+
+    return ytparse
+
+
+def get_base_parser():
+    """Get the base level parser primarily for documentation."""
+    return get_parser().get_parser()
+
+
+def get_args(parser):
+    """Get the arguments from the parser."""
+    args = parser.parse_args()
+
+    # Get the initial set of arguments
+    init_args = parser.parse_args()
+
+    # Override the command-line arguments with the input file
+    if init_args.ifile:
+        args = parser.override_args(init_args, init_args.ifile)
+    else:
+        args = vars(init_args)
+
+    # Return the parsed arguments as a dict
+    return args
+
+
+def main():
+    """Main function for converting slices."""
+
+    # Parse the input arguments
+    parser = get_parser()
+    args = get_args(parser)
+
+    # Write the converted slices next to the npz files unless told otherwise
+    outpath = args["outpath"] or args["datapath"]
+    os.makedirs(outpath, exist_ok=True)
+
+    # Loop over the npz files in the data directory
+    for fname in sorted(glob.glob(os.path.join(args["datapath"], "*.npz"))):
+        sidecar = slice_store.convert_npz(fname, outpath=outpath)
+        if args["verbose"]:
+            print(f"Converted {fname} to {sidecar}")
+
+
+if __name__ == "__main__":
+    main()
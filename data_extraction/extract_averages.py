@@ -1,13 +1,20 @@
 """Extracts domain averaged quantities and saves for plotting."""
 
+import functools
 import os
 import sys
 import time
 
+import h5py
+import numpy as np
 import pandas as pd
 import yt
+from yt.utilities.parallel_tools.parallel_analysis_interface import (
+    communication_system,
+)
 
 sys.path.append(os.path.abspath(os.path.join(sys.argv[0], "../../")))
+import ytscripts.average_store as average_store  # noqa: E402
 import ytscripts.utilities as utils  # noqa: E402
 import ytscripts.ytargs as ytargs  # noqa: E402
 
@@ -42,11 +49,358 @@ def get_args(parser):
     # Check to see if mutually inclusive argument are respected
     if args["normal"] and (not args["location"]):
         raise ValueError('"Location" needs to be defined for use with "normal".')
+    if args["condition"] and (not args["condition_range"]):
+        raise ValueError('"condition_range" needs to be defined for "condition".')
+    if args["joint"] and (not args["condition"]):
+        raise ValueError('"condition" needs to be defined for use with "joint".')
+    if args["condition"] and args["incremental"]:
+        raise ValueError('"condition" cannot be used with "incremental".')
+    if args["profile"] and args["incremental"]:
+        raise ValueError('"profile" cannot be used with "incremental".')
+    if args["profile"] and args["profile"] == args["normal"]:
+        raise ValueError('"profile" must be along a direction in the "normal" slice.')
+
+    # Joint PDFs are given as a multiple of three arguments [FIELD, MIN, MAX]
+    if args["joint"]:
+        if not len(args["joint"]) % 3 == 0:
+            raise ValueError('"joint" must be a multiple of 3! [FIELD, MIN, MAX]')
+        args["joint"] = [
+            (
+                args["joint"][idx],
+                float(args["joint"][idx + 1]),
+                float(args["joint"][idx + 2]),
+            )
+            for idx in range(0, len(args["joint"]), 3)
+        ]
 
     # Return the parsed arguments
     return args
 
 
+def get_chunk_stats(chunk, fields, density=None):
+    """Get the weighted moments of every field on one chunk of data."""
+    weight = chunk[("boxlib", "cell_volume")].d
+    if weight.size == 0 or not weight.sum() > 0:
+        return None
+    values = np.array([chunk[("boxlib", field)].d for field in fields])
+
+    total = weight.sum()
+    mean = values @ weight / total
+    stats = {
+        "weight": total,
+        "mean": mean,
+        "m2": ((values - mean[:, None]) ** 2) @ weight,
+        "min": values.min(axis=1),
+        "max": values.max(axis=1),
+    }
+
+    # Weight the mean by the density as well for the Favre average
+    if density is not None:
+        rho_weight = chunk[("boxlib", density)].d * weight
+        stats["rho_weight"] = rho_weight.sum()
+        stats["favre"] = values @ rho_weight / stats["rho_weight"]
+
+    return stats
+
+
+def merge_stats(stats, other):
+    """Merge the moments of two sets of data (Chan et al. parallel update)."""
+    if stats is None:
+        return other
+    if other is None:
+        return stats
+
+    total = stats["weight"] + other["weight"]
+    delta = other["mean"] - stats["mean"]
+    merged = {
+        "weight": total,
+        "mean": stats["mean"] + delta * other["weight"] / total,
+        "m2": stats["m2"]
+        + other["m2"]
+        + delta**2 * stats["weight"] * other["weight"] / total,
+        "min": np.minimum(stats["min"], other["min"]),
+        "max": np.maximum(stats["max"], other["max"]),
+    }
+    if "favre" in stats:
+        rho_total = stats["rho_weight"] + other["rho_weight"]
+        merged["rho_weight"] = rho_total
+        merged["favre"] = (
+            stats["favre"] * stats["rho_weight"] + other["favre"] * other["rho_weight"]
+        ) / rho_total
+
+    return merged
+
+
+def get_bin_index(values, lo, hi, nbins):
+    """Get the values inside [lo, hi] and the index of their bin."""
+    inside = (values >= lo) & (values <= hi)
+    ibin = ((values[inside] - lo) * (nbins / (hi - lo))).astype(np.int64)
+
+    return inside, np.minimum(ibin, nbins - 1)
+
+
+def get_empty_bins(fields, condition, joint=None):
+    """Get the zeroed binned sums of every field to add the chunks into."""
+    nbins = condition[3]
+    bins = {"volume": np.zeros(nbins)}
+    bins.update({field: np.zeros(nbins) for field in fields})
+    bins.update(
+        {f"{field}_joint": np.zeros((nbins, nbins)) for field, _, _ in joint or []}
+    )
+
+    return bins
+
+
+def add_chunk_bins(bins, chunk, fields, condition, joint=None):
+    """Add the weighted sums of every field on one chunk to the condition bins."""
+    cfield, lo, hi, nbins = condition
+    weight = chunk[("boxlib", "cell_volume")].d
+    inside, ibin = get_bin_index(chunk[("boxlib", cfield)].d, lo, hi, nbins)
+    weight = weight[inside]
+
+    bins["volume"] += np.bincount(ibin, weights=weight, minlength=nbins)
+    for field in fields:
+        values = chunk[("boxlib", field)].d[inside]
+        bins[field] += np.bincount(ibin, weights=weight * values, minlength=nbins)
+
+    # Bin the joint fields on the same number of bins as the condition
+    for field, jlo, jhi in joint or []:
+        jinside, jbin = get_bin_index(
+            chunk[("boxlib", field)].d[inside], jlo, jhi, nbins
+        )
+        bins[f"{field}_joint"] += np.bincount(
+            ibin[jinside] * nbins + jbin,
+            weights=weight[jinside],
+            minlength=nbins * nbins,
+        ).reshape(nbins, nbins)
+
+
+def get_empty_profile(fields, profile):
+    """Get the zeroed layer sums of every field to add the chunks into."""
+    nlayers = profile[3]
+    sums = {"area": np.zeros(nlayers)}
+    sums.update({field: np.zeros(nlayers) for field in fields})
+
+    return sums
+
+
+def add_chunk_profile(sums, chunk, fields, profile):
+    """Add the area weighted fields of one chunk to every finest layer of an axis."""
+    axis, left, dfine, _, line_axis = profile
+    axes = "xyz"
+    dcell = chunk[("index", f"d{axes[axis]}")].d
+    weight = chunk[("boxlib", "cell_volume")].d / dcell
+    if line_axis is not None:
+        weight = weight / chunk[("index", f"d{axes[line_axis]}")].d
+
+    # First finest layer and number of finest layers covered by each cell
+    ratio = np.rint(dcell / dfine).astype(np.int64)
+    start = np.rint(
+        (chunk[("index", axes[axis])].d - 0.5 * dcell - left) / dfine
+    ).astype(np.int64)
+
+    values = {field: chunk[("boxlib", field)].d for field in fields}
+    for level_ratio in np.unique(ratio):
+        # Sum the cells of this level on each of their own layers
+        cells = np.flatnonzero(ratio == level_ratio)
+        layers = start[cells] // level_ratio
+        order = np.argsort(layers, kind="stable")
+        cells, layers = cells[order], layers[order]
+        bounds = np.flatnonzero(np.diff(layers, prepend=-1))
+
+        # Spread each layer over the finest layers it covers
+        fine = (layers[bounds, None] * level_ratio + np.arange(level_ratio)).ravel()
+        sums["area"][fine] += np.repeat(
+            np.add.reduceat(weight[cells], bounds), level_ratio
+        )
+        for field in fields:
+            sums[field][fine] += np.repeat(
+                np.add.reduceat(weight[cells] * values[field][cells], bounds),
+                level_ratio,
+            )
+
+
+def reduce_fields(
+    data,
+    fields,
+    stats,
+    density="density",
+    condition=None,
+    joint=None,
+    profile=None,
+):
+    """Reduce every field over the data in one pass, reading each chunk once."""
+    read_fields = [("boxlib", field) for field in fields]
+    read_fields.append(("boxlib", "cell_volume"))
+    if "favre" in stats:
+        read_fields.append(("boxlib", density))
+    else:
+        density = None
+    if condition is not None:
+        read_fields.append(("boxlib", condition[0]))
+        read_fields.extend(("boxlib", field) for field, _, _ in joint or [])
+
+    # Split the chunks over the ranks working on this dataset, like yt does, and
+    # merge each chunk into the running totals as soon as it is read
+    reduced = {"stats": None, "bins": None, "profile": None}
+    if condition is not None:
+        reduced["bins"] = get_empty_bins(fields, condition, joint=joint)
+    if profile is not None:
+        reduced["profile"] = get_empty_profile(fields, profile)
+    for chunk in yt.parallel_objects(data.chunks([], "io"), -1):
+        chunk.get_data(read_fields)
+        reduced["stats"] = merge_stats(
+            reduced["stats"], get_chunk_stats(chunk, fields, density=density)
+        )
+        if condition is not None:
+            add_chunk_bins(reduced["bins"], chunk, fields, condition, joint=joint)
+        if profile is not None:
+            add_chunk_profile(reduced["profile"], chunk, fields, profile)
+
+    # Merge the totals of every rank working on this dataset
+    comm = communication_system.communicators[-1]
+    all_stats = comm.par_combine_object([reduced["stats"]], datatype="list", op="cat")
+    reduced["stats"] = functools.reduce(merge_stats, all_stats, None)
+    for key in ["bins", "profile"]:
+        if reduced[key] is not None:
+            reduced[key] = {
+                name: comm.mpi_allreduce(sums, op="sum")
+                for name, sums in reduced[key].items()
+            }
+
+    return reduced
+
+
+def get_stat_values(total, fields, stats):
+    """Get the requested statistics of every field as plain floats."""
+    values = {}
+    for ifield, field in enumerate(fields):
+        if total is None:
+            mean = var = fmin = fmax = favre = np.nan
+        else:
+            mean = total["mean"][ifield]
+            var = total["m2"][ifield] / total["weight"]
+            fmin = total["min"][ifield]
+            fmax = total["max"][ifield]
+            favre = total["favre"][ifield] if "favre" in total else np.nan
+
+        stat_values = {
+            "mean": mean,
+            "min": fmin,
+            "max": fmax,
+            "var": var,
+            "rms": np.sqrt(var + mean**2),
+            "favre": favre,
+        }
+        for stat in stats:
+            values[get_stat_name(field, stat)] = float(stat_values[stat])
+
+    return values
+
+
+def get_stat_name(field, stat):
+    """Get the column name of a statistic (the mean keeps the bare field name)."""
+    return field if stat == "mean" else f"{field}_{stat}"
+
+
+def get_stat_units(ds, fields, stats):
+    """Get the units of every statistic column from the field definitions."""
+    units = {"time": str(ds.current_time.units)}
+    for field in fields:
+        field_units = str(ds.field_info[("boxlib", field)].units)
+        for stat in stats:
+            if stat == "var":
+                unit = f"({field_units})**2" if field_units else ""
+            else:
+                unit = field_units
+            units[get_stat_name(field, stat)] = unit
+
+    return units
+
+
+def get_missing_fields(done, path, fields, stats):
+    """Get the fields with a statistic not yet stored for this version of a file."""
+    mtime, columns = done.get(os.path.basename(path), (None, set()))
+    if mtime != average_store.get_mtime(path):
+        return list(fields)
+
+    return [
+        field
+        for field in fields
+        if any(get_stat_name(field, stat) not in columns for stat in stats)
+    ]
+
+
+def get_bin_values(bins, fields, condition, joint=None):
+    """Get the conditional means and the (joint) PDFs from the binned sums."""
+    _, lo, hi, nbins = condition
+    dbin = (hi - lo) / nbins
+    volume = bins["volume"]
+    total = volume.sum()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = {"pdf": volume / (total * dbin)}
+        for field in fields:
+            values[f"{field}_cond"] = bins[field] / volume
+        for field, jlo, jhi in joint or []:
+            joint_volume = bins[f"{field}_joint"]
+            values[f"{field}_joint_pdf"] = joint_volume / (
+                joint_volume.sum() * dbin * (jhi - jlo) / nbins
+            )
+
+    return values
+
+
+def get_profile_values(sums, fields):
+    """Get the mean profile of every field from the layer sums."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {field: sums[field] / sums["area"] for field in fields}
+
+
+def write_time_series(f, data_dict, units=None):
+    """Write arrays keyed by time to (time, ...) datasets, sorted by time."""
+    times = sorted(data_dict)
+    f.create_dataset("time", data=np.array(times, dtype=np.float64))
+    for key in data_dict[times[0]]:
+        f.create_dataset(
+            key,
+            data=np.stack([data_dict[itime][key] for itime in times]),
+            dtype=np.float64,
+        )
+    for key, unit in (units or {}).items():
+        if key in f:
+            f[key].attrs["units"] = unit
+
+
+def save_bins(fname, data_dict, condition, joint=None, units=None):
+    """Save the binned statistics of every time to an hdf5 file, sorted by time."""
+    cfield, lo, hi, nbins = condition
+    with h5py.File(fname, "w") as f:
+        f.attrs["condition"] = cfield
+        f.create_dataset("edges", data=np.linspace(lo, hi, nbins + 1))
+        for jfield, jlo, jhi in joint or []:
+            f.create_dataset(f"{jfield}_edges", data=np.linspace(jlo, jhi, nbins + 1))
+        write_time_series(f, data_dict, units=units)
+
+
+def save_profiles(fname, data_dict, profile, units=None):
+    """Save the profiles of every time to an hdf5 file, sorted by time."""
+    axis, left, dfine, nlayers, _ = profile
+    with h5py.File(fname, "w") as f:
+        f.attrs["axis"] = "xyz"[axis]
+        f.create_dataset("coords", data=left + (np.arange(nlayers) + 0.5) * dfine)
+        write_time_series(f, data_dict, units=units)
+
+
+def get_table(data_dict, units):
+    """Assemble the results keyed by time into a time sorted float64 table."""
+    df = pd.DataFrame.from_dict(data_dict, orient="index", dtype=np.float64)
+    df = df.sort_index().rename_axis("time").reset_index()
+    df.attrs["units"] = {column: units.get(column, "") for column in df.columns}
+
+    return df
+
+
 def main():
     # Parse the input arguments
     parser = get_parser()
@@ -78,6 +432,16 @@ def main():
     if yt.is_root():
         start_time = time.time()
 
+    # Only load the plot files that are missing a requested statistic
+    select = None
+    if args["incremental"]:
+        store_file = os.path.join(outpath, f"""{args["name"]}.hdf5""")
+        done = average_store.get_done(store_file)
+
+        select = functools.partial(
+            get_missing_fields, done, fields=args["fields"], stats=args["stats"]
+        )
+
     # Load data files into dataset series
     ts, _ = utils.load_dataseries(
         datapath=args["datapath"],
@@ -85,11 +449,14 @@ def main():
         units_override=units_override,
         nprocs=args["nprocs"],
         nskip=args["nskip"],
+        select=select,
     )
 
-    base_attributes = utils.get_attributes(ds=ts[0])
+    if len(ts) > 0:
+        base_ds = ts[0]
+        base_attributes = utils.get_attributes(ds=base_ds)
 
-    if args["verbose"]:
+    if args["verbose"] and len(ts) > 0:
         print(f"""The fields in this dataset are: {base_attributes["field_list"]}""")
         print(
             f"""The derived fields in this dataset are: """
@@ -99,6 +466,28 @@ def main():
     # define normal dict
     norm_dict = {"x": 0, "y": 1, "z": 2}
 
+    # Bin the statistics by the condition field, if requested
+    if args["condition"]:
+        condition = (args["condition"], *args["condition_range"], args["nbins"])
+    else:
+        condition = None
+
+    # Average over the planes (or lines in a slice) at every finest layer of an axis
+    if args["profile"]:
+        axis = norm_dict[args["profile"]]
+        nlayers = int(
+            base_attributes["dimensions"][axis] * 2 ** base_attributes["max_level"]
+        )
+        profile = (
+            axis,
+            float(base_attributes["left_edge"][axis]),
+            float(base_attributes["width"][axis]) / nlayers,
+            nlayers,
+            norm_dict[args["normal"]] if args["normal"] else None,
+        )
+    else:
+        profile = None
+
     # Loop over the dataseries
     if not args["no_mpi"]:
         yt.enable_parallelism()
@@ -120,24 +509,87 @@ def main():
                 axis=norm_dict[args["normal"]], coord=args["location"], data_source=data
             )
 
-        # Loop over the specified variables
-        tmp_data = {}
-        for field in args["fields"]:
-            tmp_data[field] = data.mean(
-                ("boxlib", field), weight=("boxlib", "cell_volume")
+        # Only compute the fields missing from the store for this file
+        if args["incremental"]:
+            fields = get_missing_fields(
+                done, ds.output_dir, fields=args["fields"], stats=args["stats"]
+            )
+            if not fields:
+                continue
+        else:
+            fields = args["fields"]
+
+        # Reduce all of the specified variables together
+        reduced = reduce_fields(
+            data=data,
+            fields=fields,
+            stats=args["stats"],
+            density=args["density"],
+            condition=condition,
+            joint=args["joint"],
+            profile=profile,
+        )
+        values = get_stat_values(
+            total=reduced["stats"], fields=fields, stats=args["stats"]
+        )
+        sto.result = {"values": values}
+        if condition is not None:
+            sto.result["bins"] = get_bin_values(
+                reduced["bins"], fields, condition, joint=args["joint"]
+            )
+        if profile is not None:
+            sto.result["profile"] = get_profile_values(reduced["profile"], fields)
+
+        # Append the file to the store as soon as it is done to allow resuming
+        if args["incremental"] and communication_system.communicators[-1].rank == 0:
+            average_store.append_results(
+                fname=store_file,
+                plt=os.path.basename(ds.output_dir),
+                mtime=average_store.get_mtime(ds.output_dir),
+                time=sto.result_id,
+                values=values,
+                units=get_stat_units(ds, fields=fields, stats=args["stats"]),
             )
-
-        sto.result = tmp_data
 
     if yt.is_root():
-        # Convert into a pandas dataframe for storage
-        # df = pd.DataFrame(data={"time": time}, columns=["time"])
-        df = pd.DataFrame(data={"time": data_dict.keys()})
-
-        # Loop over the dataframe and add the data
-        for idx, cell in df.iterrows():
-            for key, value in data_dict[cell["time"]].items():
-                df.loc[idx, key] = value
+        # Convert into a pandas dataframe for storage, with units in the attrs
+        if args["incremental"]:
+            data_dict, units = average_store.get_results(
+                store_file,
+                columns=[
+                    get_stat_name(field, stat)
+                    for field in args["fields"]
+                    for stat in args["stats"]
+                ],
+            )
+        else:
+            units = get_stat_units(base_ds, fields=args["fields"], stats=args["stats"])
+            results = data_dict
+            data_dict = {key: result["values"] for key, result in results.items()}
+        df = get_table(data_dict=data_dict, units=units)
+
+        # Save the binned statistics and the profiles next to the table
+        if condition is not None:
+            save_bins(
+                fname=os.path.join(outpath, f"""{args["name"]}_cond.hdf5"""),
+                data_dict={key: result["bins"] for key, result in results.items()},
+                condition=condition,
+                joint=args["joint"],
+                units={
+                    f"{field}_cond": str(base_ds.field_info[("boxlib", field)].units)
+                    for field in args["fields"]
+                },
+            )
+        if profile is not None:
+            save_profiles(
+                fname=os.path.join(outpath, f"""{args["name"]}_profile.hdf5"""),
+                data_dict={key: result["profile"] for key, result in results.items()},
+                profile=profile,
+                units={
+                    field: str(base_ds.field_info[("boxlib", field)].units)
+                    for field in args["fields"]
+                },
+            )
 
         # Save the data for later
         df.to_pickle(os.path.join(outpath, f"""{args["name"]}.pkl"""))
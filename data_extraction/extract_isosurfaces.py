@@ -1,16 +1,19 @@
 """Extracts iso-surfaces from plot files and saves."""
 
+import glob
+import itertools
 import os
 import sys
 import time
+import warnings
+from collections import OrderedDict
 
 import h5py
 import numpy as np
+import pandas as pd
 from mpi4py import MPI
 from scipy.ndimage import gaussian_filter
-from skimage.measure import marching_cubes
-
-# from skimage.measure import mesh_surface_area
+from skimage.measure import marching_cubes, mesh_surface_area
 
 sys.path.append(os.path.abspath(os.path.join(sys.argv[0], "../../")))
 import ytscripts.utilities as utils  # noqa: E402
@@ -44,221 +47,711 @@ def get_args(parser):
     else:
         args = vars(init_args)
 
+    # Check to see if mutually exclusive arguments are respected
+    if args["series"] and args["parallel_write"]:
+        raise ValueError('"series" cannot be used with "parallel_write".')
+
+    # Keep accepting the old flag from input files, but say that it does nothing
+    if args["single_level"]:
+        warnings.warn(
+            '"single_level" is deprecated and ignored, ghost zones are always '
+            "filled on the level of each grid.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+
+    # Allow a single field or value to be given in the input file
+    for key in ["field", "value"]:
+        if args[key] is not None and not isinstance(args[key], list):
+            args[key] = [args[key]]
+    if args["value"]:
+        args["value"] = [float(value) for value in args["value"]]
+
     # Return the parsed arguments as a dict
     return args
 
 
-def write_xdmf(
-    fbase, fhdf5, field, ftype, ctype, value, time, conn_shape, coord_shape, field_shape
+def get_xdmf_grid(
+    fhdf5,
+    field,
+    ftype,
+    ctype,
+    value,
+    time,
+    conn_shape,
+    coord_shape,
+    field_shape,
+    group=None,
+    name="isoSurface",
+    indent=2,
+    coord_precision=8,
 ):
-    """Write the XDMF wrapper based on the hdf5 data."""
-    # Create the XDMF file for writing
-    xdmf_file = open(f"{fbase}.xmf", "w")
-    # Form the header of the xdmf file
-    xdmf_file.write(
-        """<?xml version="1.0"?>\n"""
-        """<Xdmf Version="3.0" xmlns:xi="http://www.w3.org/2001/XInclude">\n"""
+    """Get the XDMF Grid block for one isosurface in the hdf5 file."""
+    tab = "\t" * indent
+    hpath = f"{fhdf5}.hdf5:/{group}/" if group else f"{fhdf5}.hdf5:/"
+
+    return (
+        # Form the Grid block
+        f"""{tab}<Grid Name="{name}" GridType="Uniform">\n"""
+        f"""{tab}<Information Name="Variable" Value="{field}"/>\n"""
+        f"""{tab}<Information Name="IsoValue" Value="{value}"/>\n"""
+        f"""{tab}<Time Value="{time}"/>\n"""
+        # Form the Topology block
+        f"""{tab}\t<Topology TopologyType="Triangle" NumberOfElements="""
+        f""""{conn_shape[0]} {conn_shape[1]}">\n"""
+        f"""{tab}\t\t<DataItem Name="Conn" Format="HDF" DataType="Int" """
+        f"""Precision="4" Dimensions="{conn_shape[0]} {conn_shape[1]}">\n"""
+        f"""{tab}\t\t\t{hpath}Conn\n"""
+        f"""{tab}\t\t</DataItem>\n"""
+        f"""{tab}\t</Topology>\n"""
+        # Form the Geometry block
+        f"""{tab}\t<Geometry GeometryType="XYZ" NumberOfElements="""
+        f""""{coord_shape[0]} {coord_shape[1]}">\n"""
+        f"""{tab}\t\t<DataItem Name="Coord" Format="HDF" DataType="Float" """
+        f"""Precision="{coord_precision}" """
+        f"""Dimensions="{coord_shape[0]} {coord_shape[1]}">\n"""
+        f"""{tab}\t\t\t{hpath}Coord\n"""
+        f"""{tab}\t\t</DataItem>\n"""
+        f"""{tab}\t</Geometry>\n"""
+        # Form the Attribute block
+        f"""{tab}\t<Attribute Name="{field}" AttributeType="{ftype}" """
+        f"""Center="{ctype}">\n"""
+        f"""{tab}\t\t<DataItem Format="HDF" DataType="Float" Precision="8" """
+        f"""Dimensions="{field_shape[0]}">\n"""
+        f"""{tab}\t\t\t{hpath}{field}\n"""
+        f"""{tab}\t\t</DataItem>\n"""
+        f"""{tab}\t</Attribute>\n"""
+        # Ending of the Grid block
+        f"""{tab}</Grid>\n"""
     )
 
-    # Form the Domain block
-    xdmf_file.write("\t<Domain>\n")
 
-    # Form the Grid block
-    xdmf_file.write(
-        f"""\t\t<Grid Name="isoSurface" GridType="Uniform">\n"""
-        f"""\t\t<Information Name="Variable" Value="{field}"/>\n"""
-        f"""\t\t<Information Name="IsoValue" Value="{value}"/>\n"""
-        f"""\t\t<Time Value="{time}"/>\n"""
+def get_xdmf_collection(grids, name, collection_type="Spatial", time=None, indent=2):
+    """Get an XDMF collection block wrapping a list of Grid blocks."""
+    tab = "\t" * indent
+
+    return (
+        f"""{tab}<Grid Name="{name}" GridType="Collection" """
+        f"""CollectionType="{collection_type}">\n"""
+        + (f"""{tab}<Time Value="{time}"/>\n""" if time is not None else "")
+        + "".join(grids)
+        + f"""{tab}</Grid>\n"""
     )
 
-    # Form the Topology block
-    xdmf_file.write(
-        f"""\t\t\t<Topology TopologyType="Triangle" NumberOfElements="""
-        f""""{conn_shape[0]} {conn_shape[1]}">\n"""
-        f"""\t\t\t\t<DataItem Name="Conn" Format="HDF" DataType="Int" """
-        f"""Precision="4" Dimensions="{conn_shape[0]} {conn_shape[1]}">\n"""
-        f"""\t\t\t\t\t{fhdf5}.hdf5:/Conn\n"""
-        f"""\t\t\t\t</DataItem>\n"""
-        f"""\t\t\t</Topology>\n"""
+
+def write_xdmf_file(fbase, body):
+    """Write the XDMF file with the given contents of the Domain block."""
+    with open(f"{fbase}.xmf", "w") as xdmf_file:
+        # Form the header of the xdmf file
+        xdmf_file.write(
+            """<?xml version="1.0"?>\n"""
+            """<Xdmf Version="3.0" xmlns:xi="http://www.w3.org/2001/XInclude">\n"""
+        )
+
+        # Form the Domain block
+        xdmf_file.write("\t<Domain>\n")
+        xdmf_file.write(body)
+        xdmf_file.write("\t</Domain>\n")
+
+        # Ending of the XDFM file
+        xdmf_file.write("</Xdmf>")
+
+
+def write_xdmf(
+    fbase,
+    fhdf5,
+    field,
+    ftype,
+    ctype,
+    value,
+    time,
+    conn_shape,
+    coord_shape,
+    field_shape,
+    group=None,
+    coord_precision=8,
+):
+    """Write the XDMF wrapper based on the hdf5 data."""
+    write_xdmf_file(
+        fbase=fbase,
+        body=get_xdmf_grid(
+            fhdf5=fhdf5,
+            field=field,
+            ftype=ftype,
+            ctype=ctype,
+            value=value,
+            time=time,
+            conn_shape=conn_shape,
+            coord_shape=coord_shape,
+            field_shape=field_shape,
+            group=group,
+            coord_precision=coord_precision,
+        ),
     )
 
-    # Form the Geometry block
-    xdmf_file.write(
-        f"""\t\t\t<Geometry GeometryType="XYZ" NumberOfElements="""
-        f""""{coord_shape[0]} {coord_shape[1]}">\n"""
-        f"""\t\t\t\t<DataItem Name="Coord" Format="HDF" DataType="Float" """
-        f"""Precision="8" Dimensions="{coord_shape[0]} {coord_shape[1]}">\n"""
-        f"""\t\t\t\t\t{fhdf5}.hdf5:/Coord\n"""
-        f"""\t\t\t\t</DataItem>\n"""
-        f"""\t\t\t</Geometry>\n"""
+
+def get_series_files(outpath, name):
+    """Get the hdf5 files that make up an isosurface series store."""
+    return sorted(
+        glob.glob(os.path.join(outpath, f"{name}.hdf5"))
+        + glob.glob(os.path.join(outpath, f"{name}_group*.hdf5"))
     )
 
-    # Form the Attribute block
-    xdmf_file.write(
-        f"""\t\t\t<Attribute Name="{field}" AttributeType="{ftype}" """
-        f"""Center="{ctype}">\n"""
-        f"""\t\t\t\t<DataItem Format="HDF" DataType="Float" Precision="8" """
-        f"""Dimensions="{field_shape[0]}">\n"""
-        f"""\t\t\t\t\t{fhdf5}.hdf5:/{field}\n"""
-        f"""\t\t\t\t</DataItem>\n"""
-        f"""\t\t\t</Attribute>\n"""
+
+def get_series_steps(files):
+    """Get the completed steps in the isosurface series store."""
+    steps = set()
+    for fname in files:
+        with h5py.File(fname, "r") as f:
+            steps.update(step for step in f if f[step].attrs.get("complete", False))
+
+    return steps
+
+
+def write_series_xdmf(fbase, files):
+    """Write a temporal XDMF collection over every step in the series store."""
+    entries = []
+    for fname in files:
+        fhdf5 = os.path.splitext(os.path.basename(fname))[0]
+        with h5py.File(fname, "r") as f:
+            for step, step_group in f.items():
+                if not step_group.attrs.get("complete", False):
+                    continue
+
+                time = step_group.attrs["time"]
+                grids = []
+                for surface, group in step_group.items():
+                    field = group.attrs["field"]
+                    grids.append(
+                        get_xdmf_grid(
+                            fhdf5=fhdf5,
+                            field=field,
+                            ftype="Scalar",
+                            ctype=group.attrs["ctype"],
+                            value=group.attrs["value"],
+                            time=time,
+                            conn_shape=group["Conn"].shape,
+                            coord_shape=group["Coord"].shape,
+                            field_shape=group[field].shape,
+                            group=f"{step}/{surface}",
+                            name=surface,
+                            indent=4,
+                            coord_precision=group["Coord"].dtype.itemsize,
+                        )
+                    )
+                entries.append(
+                    (time, get_xdmf_collection(grids, name=step, time=time, indent=3))
+                )
+
+    # Order the steps in time regardless of which file they were written to
+    entries.sort(key=lambda entry: entry[0])
+    write_xdmf_file(
+        fbase=fbase,
+        body=get_xdmf_collection(
+            [entry[1] for entry in entries],
+            name="isoSurfaceSeries",
+            collection_type="Temporal",
+        ),
     )
 
-    # Ending of the Grid block
-    xdmf_file.write("\t\t</Grid>\n")
 
-    # Ending of the Domain block
-    xdmf_file.write("\t</Domain>\n")
+def combine_meshes(verts, faces, samples):
+    """Combine lists of mesh pieces into single arrays in one pass."""
+    if len(verts) == 0:
+        return (
+            np.empty((0, 3), dtype=np.float64),
+            np.empty((0, 3), dtype=np.int32),
+            np.empty((0), dtype=np.float64),
+        )
+
+    # Prefix sum of the vertex counts gives the face offset of each piece
+    num_verts = np.array([len(v) for v in verts], dtype=np.int64)
+    vert_offsets = np.concatenate(([0], np.cumsum(num_verts)))
+    num_faces = np.array([len(f) for f in faces], dtype=np.int64)
+    face_offsets = np.concatenate(([0], np.cumsum(num_faces)))
+
+    # Allocate the output once and fill each piece in place
+    all_faces = np.empty((face_offsets[-1], 3), dtype=np.int32)
+    for i, piece in enumerate(faces):
+        np.add(
+            piece,
+            vert_offsets[i],
+            out=all_faces[face_offsets[i] : face_offsets[i + 1]],
+            casting="unsafe",
+        )
+
+    all_verts = np.concatenate(verts, axis=0).astype(np.float64, copy=False)
+    all_samples = np.concatenate(samples, axis=0).astype(np.float64, copy=False)
+
+    return all_verts, all_faces, all_samples
+
+
+def weld_vertices(verts, faces, tol):
+    """Merge vertices that fall in the same cell of a hashed grid of size tol."""
+    if len(verts) == 0:
+        return verts, faces, np.arange(0)
+
+    # Quantize the vertices onto the integer grid
+    ijk = np.rint((verts - verts.min(axis=0)) / tol).astype(np.int64)
+    span = ijk.max(axis=0) + 1
+
+    if np.prod(span.astype(np.float64)) < 2**63:
+        # Hash each grid cell to a single integer key for a fast 1D unique
+        keys = np.ravel_multi_index(tuple(ijk.T), tuple(span))
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(
+            ijk, axis=0, return_index=True, return_inverse=True
+        )
+
+    # Point the faces at the first vertex found in each cell
+    faces = inverse.ravel()[faces].astype(np.int32)
+
+    return verts[first], faces, first
+
+
+def get_dataset_opts(compression=None, shuffle=False, quantize=None):
+    """Get the hdf5 dataset options for the mesh and the sampled field."""
+    opts = {}
+    if compression or shuffle or quantize is not None:
+        # Filters need chunked datasets
+        opts = {"chunks": True, "compression": compression, "shuffle": shuffle}
 
-    # Ending of the XDFM file
-    xdmf_file.write("</Xdmf>")
+    # Keep only the requested number of decimal digits of the sampled field
+    field_opts = dict(opts, scaleoffset=quantize) if quantize is not None else opts
 
-    xdmf_file.close()
+    return opts, field_opts
 
 
-def write_hdf5(verts, samples, faces, field, fname):
+def write_hdf5(
+    verts,
+    samples,
+    faces,
+    field,
+    fname,
+    group=None,
+    mode="w",
+    coord_precision=8,
+    compression=None,
+    shuffle=False,
+    quantize=None,
+):
     """Write the HDF5 file based on the extracted isosurface."""
-    with h5py.File(fname, "w") as f:
-        f.create_dataset("Conn", data=faces.astype(np.int32), dtype=np.int32)
-        f.create_dataset("Coord", data=verts, dtype=np.float64)
-        f.create_dataset(field, data=samples, dtype=np.float64)
+    prefix = f"{group}/" if group else ""
+    coord_dtype = np.float32 if coord_precision == 4 else np.float64
+    opts, field_opts = get_dataset_opts(
+        compression=compression, shuffle=shuffle, quantize=quantize
+    )
+    with h5py.File(fname, mode) as f:
+        f.create_dataset(
+            f"{prefix}Conn", data=faces.astype(np.int32), dtype=np.int32, **opts
+        )
+        f.create_dataset(
+            f"{prefix}Coord", data=verts.astype(coord_dtype), dtype=coord_dtype, **opts
+        )
+        f.create_dataset(
+            f"{prefix}{field}", data=samples, dtype=np.float64, **field_opts
+        )
 
     return np.shape(faces), np.shape(verts), np.shape(samples)
 
 
-def do_isosurface_extraction(
-    dregion,
-    ds_attributes,
-    outformat,
+def write_slab_collective(dset, start, data):
+    """Write the rows of this rank collectively, even when it has no rows."""
+    with dset.collective:
+        if len(data) > 0:
+            dset[start : start + len(data)] = data
+            return
+
+        # h5py skips empty writes, but every rank has to join a collective write
+        fspace = dset.id.get_space()
+        fspace.select_none()
+        mspace = h5py.h5s.create_simple((1,) * dset.ndim)
+        mspace.select_none()
+        dset.id.write(
+            mspace,
+            fspace,
+            np.empty((1,) * dset.ndim, dtype=dset.dtype),
+            dxpl=dset._dxpl,
+        )
+
+
+def write_hdf5_parallel(
+    verts,
+    samples,
+    faces,
     field,
-    value,
-    outpath,
     fname,
     comm,
-    rank,
-    size,
+    group=None,
+    mode="w",
+    coord_precision=8,
+    compression=None,
+    shuffle=False,
+    quantize=None,
+):
+    """Write the HDF5 file with each rank writing its own slab of the mesh."""
+    rank = comm.Get_rank()
+    prefix = f"{group}/" if group else ""
+    coord_dtype = np.float32 if coord_precision == 4 else np.float64
+    opts, field_opts = get_dataset_opts(
+        compression=compression, shuffle=shuffle, quantize=quantize
+    )
+
+    # Exclusive scan of the local counts gives the offset of this rank's slab
+    counts = np.array([len(verts), len(faces)], dtype=np.int64)
+    offsets = np.zeros(2, dtype=np.int64)
+    comm.Exscan(counts, offsets, op=MPI.SUM)
+    if rank == 0:
+        offsets[:] = 0
+    totals = np.zeros(2, dtype=np.int64)
+    comm.Allreduce(counts, totals, op=MPI.SUM)
+
+    vert_start, face_start = offsets
+    num_verts, num_faces = totals
+
+    # Shift the local face indices into the global vertex numbering
+    faces = (faces + vert_start).astype(np.int32)
+    verts = verts.astype(coord_dtype)
+
+    if h5py.get_config().mpi:
+        # Collective write into shared datasets with the mpio driver
+        with h5py.File(fname, mode, driver="mpio", comm=comm) as f:
+            dconn = f.create_dataset(
+                f"{prefix}Conn", (num_faces, 3), dtype=np.int32, **opts
+            )
+            dcoord = f.create_dataset(
+                f"{prefix}Coord", (num_verts, 3), dtype=coord_dtype, **opts
+            )
+            dfield = f.create_dataset(
+                f"{prefix}{field}", (num_verts,), dtype=np.float64, **field_opts
+            )
+
+            write_slab_collective(dconn, face_start, faces)
+            write_slab_collective(dcoord, vert_start, verts)
+            write_slab_collective(dfield, vert_start, samples)
+    else:
+        # Write per-rank files and stitch them together with virtual datasets
+        fbase, fext = os.path.splitext(fname)
+        rank_fname = f"{fbase}_rank{rank:05d}{fext}"
+        with h5py.File(rank_fname, mode) as f:
+            f.create_dataset(f"{prefix}Conn", data=faces, dtype=np.int32, **opts)
+            f.create_dataset(f"{prefix}Coord", data=verts, dtype=coord_dtype, **opts)
+            f.create_dataset(
+                f"{prefix}{field}", data=samples, dtype=np.float64, **field_opts
+            )
+
+        all_counts = comm.gather(counts, root=0)
+        all_offsets = comm.gather(offsets, root=0)
+        all_fnames = comm.gather(os.path.basename(rank_fname), root=0)
+
+        comm.barrier()
+        if rank == 0:
+            conn_name = f"{prefix}Conn"
+            coord_name = f"{prefix}Coord"
+            field_name = f"{prefix}{field}"
+            layouts = {
+                conn_name: h5py.VirtualLayout(shape=(num_faces, 3), dtype=np.int32),
+                coord_name: h5py.VirtualLayout(shape=(num_verts, 3), dtype=coord_dtype),
+                field_name: h5py.VirtualLayout(shape=(num_verts,), dtype=np.float64),
+            }
+            for (nv, nf), (vs, fs), rfname in zip(all_counts, all_offsets, all_fnames):
+                if nv == 0:
+                    continue
+                layouts[conn_name][fs : fs + nf] = h5py.VirtualSource(
+                    rfname, conn_name, shape=(nf, 3)
+                )
+                layouts[coord_name][vs : vs + nv] = h5py.VirtualSource(
+                    rfname, coord_name, shape=(nv, 3)
+                )
+                layouts[field_name][vs : vs + nv] = h5py.VirtualSource(
+                    rfname, field_name, shape=(nv,)
+                )
+
+            with h5py.File(fname, mode, libver="latest") as f:
+                for name, layout in layouts.items():
+                    f.create_virtual_dataset(name, layout)
+        comm.barrier()
+
+    return (num_faces, 3), (num_verts, 3), (num_verts,)
+
+
+def assign_grids(
+    ds,
+    ds_attributes,
+    fields,
+    values,
+    comm,
+    partition="lpt",
+    cull=True,
     do_ghost=False,
-    do_yt=False,
-    single_level=False,
-    smooth=None,
-    ds=None,
-    iso_edge=None,
-    do_gradient=False,
+    bounds_files=None,
+    n_halo=0,
+    level_aware=False,
 ):
-    """Do the isosurface extraction according to the input parameters."""
-    if outformat == "ply":
-        # Create iso-surface
-        surf = ds.surface(
-            data_source=dregion,
-            surface_field=field,
-            field_value=value,
+    """Cull grids that cannot contain any surface and partition the rest by cost."""
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    index = ds.index
+    num_grids = len(index.grids)
+    ncells = np.prod(index.grid_dimensions, axis=1)
+
+    # Find the cells left uncovered by the finer levels from the index alone
+    boxes = None
+    if level_aware:
+        if rank == 0:
+            boxes = utils.get_uncovered_boxes(ds)
+        boxes = comm.bcast(boxes, root=0)
+
+    # Read the per-grid bounds once and share them with every rank
+    bounds = {}
+    if rank == 0 and (cull or partition != "round_robin"):
+        for field in fields:
+            if bounds_files:
+                bounds[field] = utils.load_bounds_index(bounds_files[field], ds)
+            if bounds.get(field) is None:
+                bounds[field] = utils.get_grid_bounds(ds, field)
+    bounds = comm.bcast(bounds, root=0)
+
+    # Find the grids that might contain each of the surfaces
+    brackets = {}
+    for field in fields:
+        if field in bounds:
+            mins, maxs = bounds[field]
+            if do_ghost or n_halo:
+                # Ghost zones can bring in values from the neighboring grids
+                mins, maxs = utils.get_neighbor_bounds(
+                    ds, mins, maxs, n_zones=int(do_ghost) + n_halo
+                )
+        for value in values:
+            if field in bounds:
+                brackets[(field, value)] = ~((mins > value) | (maxs < value))
+            else:
+                brackets[(field, value)] = np.ones(num_grids, dtype=bool)
+    contains = np.any(list(brackets.values()), axis=0)
+
+    # A grid can be skipped when none of the values are inside of its bounds
+    if cull:
+        skip = ~contains
+    else:
+        skip = np.zeros(num_grids, dtype=bool)
+        brackets = {key: np.ones(num_grids, dtype=bool) for key in brackets}
+
+    # Grids fully covered by finer levels are never read
+    culled = skip.copy()
+    cells = ncells
+    if level_aware:
+        covered = np.array([box is None for box in boxes])
+        cells = np.array(
+            [0 if box is None else np.prod(box[1] - box[0]) for box in boxes]
         )
+        if rank == 0:
+            print(
+                f"Skipped {np.count_nonzero(covered & ~skip)} of {num_grids} grids "
+                f"fully covered by finer levels, saving "
+                f"{np.sum((ncells - cells)[~skip]) * 8 * len(fields) / 1e6:.2f} MB "
+                "of reads."
+            )
+        skip |= covered
+
+    active = np.where(~skip)[0]
+    costs = utils.get_grid_costs(ds, empty=~contains, cells=cells)
+    centers = (
+        0.5 * (index.grid_left_edge + index.grid_right_edge)
+        - ds_attributes["left_edge"]
+    ) / ds_attributes["width"]
+    parts = utils.partition_grids(
+        costs[active], size, method=partition, centers=np.asarray(centers)[active]
+    )
 
-        surf.export_ply(
-            os.path.join(outpath, f"{fname}.ply"),
-            bounds=[(-1.0, 1.0), (-1.0, 1.0), (-1.0, 1.0)],
-            no_ghost=True,
+    if rank == 0:
+        saved = np.sum(ncells[culled]) * np.dtype(np.float64).itemsize * len(fields)
+        print(
+            f"Culled {np.count_nonzero(culled)} of {num_grids} grids that cannot "
+            f"contain {values}, saving {saved / 1e6:.2f} MB of reads."
         )
-    elif outformat == "obj":
-        dregion.extract_isocontours(
-            field=field,
-            value=value,
-            filename=os.path.join(outpath, f"{fname}.obj"),
-            rescale=False,
+        stats = utils.get_partition_stats(costs[active], parts)
+        print(
+            f"""Grid partition ({partition}): load min = {stats["min"]:.3e}, """
+            f"""mean = {stats["mean"]:.3e}, max = {stats["max"]:.3e}, """
+            f"""imbalance = {stats["imbalance"]:.3f}"""
         )
-    elif outformat in ["hdf5", "xdmf"]:
-        # xdmf or hdf5 will write the hdf5 file and the xdmf wrapper file
 
-        if do_yt:
-            verts, samples = dregion.extract_isocontours(
-                field=field,
-                value=value,
-                rescale=False,
-                sample_values=field,
-            )
+    return active[parts[rank]], bounds, brackets, boxes
 
-            all_verts_np = np.array(verts)
-            # Get the shape of the vertices for the connection array
-            len_verts, dep_verts = np.shape(verts)
 
-            # Make faces connection array taking the vertices in groups of three
-            faces_np = np.arange(0, len_verts, 1)
-            all_faces_np = faces_np.reshape((-1, dep_verts))
-            all_samples_np = np.array(samples)
+def read_grid_box(g, field, box, fab=None, icomp=None):
+    """Read the part of a grid inside of a local index box and count the bytes."""
+    lo, hi = box
+    if fab is not None and icomp is not None:
+        start_idx = np.asarray(g.get_global_startindex())
+        data = utils.read_fab_box(fab, icomp, start_idx + lo, start_idx + hi)
+        if data is not None:
+            return data
 
-        else:
+    # Without direct access to the plot file the whole grid is read
+    data = np.array(g[field], dtype=np.float64)
+    return data[tuple(slice(a, b) for a, b in zip(lo, hi))], data.nbytes
 
-            verts_np = np.empty((0, 3))
-            faces_np = np.empty((0, 3))
-            samples_np = np.empty((0))
 
-            num_grids = len(dregion.index.grids)
+def extract_grid_surfaces(
+    index,
+    grid_ids,
+    fields,
+    values,
+    brackets,
+    bounds,
+    ds_attributes,
+    do_ghost=False,
+    do_gradient=False,
+    level_boxes=None,
+    smooth=None,
+    iso_edge=None,
+    boxes=None,
+    plotfile=None,
+    do_volume=False,
+):
+    """Run marching cubes for every surface on the grids owned by this rank."""
+    # Collect the mesh pieces of each surface to combine them once at the end
+    meshes = {(field, value): ([], [], []) for field in fields for value in values}
+    # Sum the area and the volume above the iso value of each surface
+    stats = {(field, value): np.zeros(2) for field in fields for value in values}
+    # Keep the bounds of any grid read without a stored min/max
+    new_bounds = []
+    # Reuse neighboring grid data across the ghost zone fills
+    ghost_cache = OrderedDict()
+    # Pad the grids by the smoothing kernel so the grid boundaries have no seams
+    n_ghost = int(do_ghost)
+    n_halo = get_smooth_halo(smooth)
+    # Count the bytes read on each level
+    grid_levels = np.asarray(index.grid_levels).ravel()
+    bytes_read = np.zeros(index.max_level + 1)
+    # Locate the fabs in the plot file to read partial grids directly
+    fabs = {}
+    icomps = {}
+
+    for igrid in grid_ids:
+        g = index.grids[igrid]
+
+        for field in fields:
+            grid_values = [v for v in values if brackets[(field, v)][igrid]]
+            if not grid_values:
+                continue
+
+            # Load and smooth the field once for all of the values
+            if n_ghost or n_halo:
+                data, child_mask, dds, origin = retrieve_ghost_zones(
+                    cube=g,
+                    n_zones=n_ghost + n_halo,
+                    fields=field,
+                    ds_left_edge=ds_attributes["left_edge"],
+                    ds_right_edge=ds_attributes["right_edge"],
+                    do_gradient=do_gradient,
+                    level_boxes=level_boxes,
+                    cache=ghost_cache,
+                )
+            elif boxes is not None:
+                # Read the uncovered cells plus one layer for the cubes on the edge
+                lo, hi = boxes[igrid]
+                lo = np.maximum(lo - 1, 0)
+                hi = np.minimum(hi + 1, g.ActiveDimensions)
+                level = grid_levels[igrid]
+                if plotfile and level not in fabs:
+                    fabs[level] = utils.read_fab_index(plotfile, level)
+                if plotfile and field not in icomps:
+                    icomps[field] = utils.get_field_component(plotfile, field)
+                fab = None
+                if fabs.get(level) is not None:
+                    ids = np.where(grid_levels == level)[0]
+                    fab = fabs[level][np.searchsorted(ids, igrid)]
+                data, nbytes = read_grid_box(
+                    g, field, (lo, hi), fab=fab, icomp=icomps.get(field)
+                )
+                bytes_read[level] += nbytes
+                child_mask = g.child_mask[tuple(slice(a, b) for a, b in zip(lo, hi))]
+                dds = np.array(g.dds)
+                origin = np.array(g.LeftEdge + (lo + 0.5) * g.dds)
+            else:
+                data = np.array(g[field], dtype=np.float64)
+                child_mask = g.child_mask
+                dds = np.array(g.dds)
+                origin = np.array(g.LeftEdge + 0.5 * g.dds)
+
+            if boxes is None or n_ghost or n_halo:
+                bytes_read[grid_levels[igrid]] += data.nbytes
+
+            # clear the data to reduce memory constraints
+            g.clear_data()
+
+            # Find the cells of the grid itself inside of the padded block
+            dims = np.asarray(g.ActiveDimensions)
+            pad_left = np.rint(
+                np.asarray(g.LeftEdge + 0.5 * g.dds - origin) / dds
+            ).astype(np.int64)
+            pad_right = np.asarray(data.shape) - dims - pad_left
+
+            # Only the bounds of a fully read grid can be kept
+            full = np.all(pad_left >= 0) and np.all(pad_right >= 0)
+            if full and (field not in bounds or np.isnan(bounds[field][0][igrid])):
+                inner = data[tuple(slice(lo, lo + n) for lo, n in zip(pad_left, dims))]
+                new_bounds.append((field, igrid, np.min(inner), np.max(inner)))
+
+            # perform smoothing before marching cubes
+            if smooth:
+                # The loaded block is a private copy so it is filtered in place
+                cube = gaussian_filter(data, sigma=smooth, output=data)
+            else:
+                cube = data
 
-            comm.barrier()
-            for g in dregion.index.grids[rank:num_grids:size]:
-
-                if do_ghost:
-                    g, child_mask = retrieve_ghost_zones(
-                        cube=g,
-                        n_zones=1,
-                        fields=field,
-                        ds_left_edge=ds_attributes["left_edge"],
-                        ds_right_edge=ds_attributes["right_edge"],
-                        single_level=single_level,
-                        do_gradient=do_gradient,
-                    )
-                else:
-                    child_mask = g.child_mask
-                # Get the physical cell spacing of the grid
-                dx, dy, dz = np.array(g.dds)
-
-                if iso_edge:
-                    child_mask = (
-                        child_mask
-                        & (np.array(g[("boxlib", "x")]) >= iso_edge[0])
-                        & (np.array(g[("boxlib", "x")]) <= iso_edge[3])
-                    )
-                    child_mask = (
-                        child_mask
-                        & (np.array(g[("boxlib", "y")]) >= iso_edge[1])
-                        & (np.array(g[("boxlib", "y")]) <= iso_edge[4])
-                    )
-                    child_mask = (
-                        child_mask
-                        & (np.array(g[("boxlib", "z")]) >= iso_edge[2])
-                        & (np.array(g[("boxlib", "z")]) <= iso_edge[5])
-                    )
+            if do_volume:
+                # Count the uncovered cells of the grid itself above each value
+                own = tuple(
+                    slice(max(lo, 0), n - max(hi, 0))
+                    for lo, hi, n in zip(pad_left, pad_right, cube.shape)
+                )
+                for value in grid_values:
+                    stats[(field, value)][1] += np.count_nonzero(
+                        child_mask[own] & (cube[own] > value)
+                    ) * np.prod(dds)
+
+            if n_halo:
+                # Drop the smoothing halo and keep the ghost zones for the surface
+                crop_left = pad_left - np.minimum(pad_left, n_ghost)
+                crop_right = pad_right - np.minimum(pad_right, n_ghost)
+                crop = tuple(
+                    slice(lo, n - hi)
+                    for lo, hi, n in zip(crop_left, crop_right, data.shape)
+                )
+                cube = cube[crop]
+                child_mask = child_mask[crop]
+                origin = origin + crop_left * dds
 
-                # perform smoothing before marching cubes
-                if smooth:
-                    cube = gaussian_filter(g[field], sigma=smooth)
-                else:
-                    cube = g[field]
+            if iso_edge:
+                child_mask = child_mask & get_edge_mask(
+                    origin=origin, dds=dds, shape=cube.shape, iso_edge=iso_edge
+                )
 
+            for value in grid_values:
                 try:
-                    verts, faces, normals, values = marching_cubes(
+                    verts, faces, normals, samples = marching_cubes(
                         volume=cube,
                         level=value,
                         allow_degenerate=True,
                         step_size=1,
                         gradient_direction="ascent",
-                        spacing=(dx, dy, dz),
+                        spacing=tuple(dds),
                         method="lewiner",
                         mask=child_mask,
                     )
 
-                    # area = mesh_surface_area(verts, faces)
+                    stats[(field, value)][0] += mesh_surface_area(verts, faces)
 
                     # offset the physical location
-                    verts += np.array(g.fcoords.min(axis=0))
+                    verts += origin
 
-                    # offset the face indices by the current length of the array
-                    len_verts, _ = np.shape(verts_np)
-                    faces += len_verts
-
-                    verts_np = np.append(verts_np, verts, axis=0)
-                    faces_np = np.append(faces_np, faces, axis=0)
-                    samples_np = np.append(samples_np, values, axis=0)
+                    meshes[(field, value)][0].append(verts)
+                    meshes[(field, value)][1].append(faces)
+                    meshes[(field, value)][2].append(samples)
 
                 except ValueError:
                     # Skip the regions that do not have values for the isosurface
@@ -268,62 +761,447 @@ def do_isosurface_extraction(
                     # Skip the regions that are fully masked
                     pass
 
-                # clear the data to reduce memory constraints
-                g.clear_data()
+    return meshes, new_bounds, bytes_read, stats
+
+
+def get_culled_volume(ds, field, value, mins, bracket):
+    """Get the uncovered volume of the grids skipped for lying above a value."""
+    index = ds.index
+    volume = 0.0
+    for igrid in np.where(~bracket & (mins > value))[0]:
+        g = index.grids[igrid]
+        volume += np.count_nonzero(g.child_mask) * np.prod(np.asarray(g.dds))
+
+    return volume
+
+
+def append_stats_table(fname, rows):
+    """Append the surface diagnostics of each step to a time series table."""
+    df = pd.DataFrame(rows)
+    if os.path.exists(fname):
+        df = pd.concat([pd.read_pickle(fname), df], ignore_index=True)
+
+    # Keep the latest entry when a step is extracted again
+    df = df.drop_duplicates(subset=["plt", "field", "value"], keep="last")
+    df = df.sort_values(by=["field", "value", "time"], ignore_index=True)
+    df.to_pickle(fname)
+
+    return df
+
+
+def do_isosurface_extraction(
+    dregion,
+    ds_attributes,
+    outformat,
+    fields,
+    values,
+    outpath,
+    fname,
+    comm,
+    rank,
+    size,
+    do_ghost=False,
+    do_yt=False,
+    smooth=None,
+    ds=None,
+    iso_edge=None,
+    do_gradient=False,
+    parallel_write=False,
+    partition="lpt",
+    cull=True,
+    bounds_files=None,
+    ghost_fill="neighbor",
+    weld=None,
+    series_file=None,
+    step=None,
+    coord_precision=8,
+    compression=None,
+    shuffle=False,
+    quantize=None,
+    level_aware=False,
+    do_volume=False,
+):
+    """Do the isosurface extraction according to the input parameters."""
+    surfaces = [(field, value) for field in fields for value in values]
+    stats = None
+    # Name each surface when more than one is written from a single pass
+    sname = {
+        (field, value): fname if len(surfaces) == 1 else f"{fname}_{field}_{value}"
+        for field, value in surfaces
+    }
+    group = {
+        (field, value): None if len(surfaces) == 1 else f"{field}_{value}"
+        for field, value in surfaces
+    }
+    if series_file:
+        # Every surface of a step goes into its own group of the series store
+        group = {(field, value): f"{step}/{field}_{value}" for field, value in surfaces}
 
-            # Explicitly cast the arrays as necessary types
-            verts_np = verts_np.astype(np.float64)
-            faces_np = faces_np.astype(np.int32)
-            samples_np = samples_np.astype(np.float64)
+    if outformat == "ply":
+        for field, value in surfaces:
+            # Create iso-surface
+            surf = ds.surface(
+                data_source=dregion,
+                surface_field=field,
+                field_value=value,
+            )
+
+            surf.export_ply(
+                os.path.join(outpath, f"{sname[(field, value)]}.ply"),
+                bounds=[(-1.0, 1.0), (-1.0, 1.0), (-1.0, 1.0)],
+                no_ghost=True,
+            )
+    elif outformat == "obj":
+        for field, value in surfaces:
+            dregion.extract_isocontours(
+                field=field,
+                value=value,
+                filename=os.path.join(outpath, f"{sname[(field, value)]}.obj"),
+                rescale=False,
+            )
+    elif outformat in ["hdf5", "xdmf"]:
+        # xdmf or hdf5 will write the hdf5 file and the xdmf wrapper file
+        all_meshes = {}
+        shapes = {}
+
+        if do_yt:
+            for field, value in surfaces:
+                verts, samples = dregion.extract_isocontours(
+                    field=field,
+                    value=value,
+                    rescale=False,
+                    sample_values=field,
+                )
+
+                all_verts_np = np.array(verts)
+                # Get the shape of the vertices for the connection array
+                len_verts, dep_verts = np.shape(verts)
+
+                # Make faces connection array taking the vertices in groups of three
+                faces_np = np.arange(0, len_verts, 1)
+                all_faces_np = faces_np.reshape((-1, dep_verts))
+                all_samples_np = np.array(samples)
+
+                if weld:
+                    all_verts_np, all_faces_np, _ = weld_vertices(
+                        verts=all_verts_np, faces=all_faces_np, tol=weld
+                    )
+
+                all_meshes[(field, value)] = (
+                    all_verts_np,
+                    all_faces_np,
+                    all_samples_np,
+                )
+
+            stats = {
+                surface: {
+                    "area": mesh_surface_area(*all_meshes[surface][:2]),
+                    "volume": np.nan,
+                }
+                for surface in surfaces
+            }
+
+        else:
+            # Assign the grids to ranks after culling by the field bounds
+            index = dregion.ds.index
+            grid_ids, bounds, brackets, boxes = assign_grids(
+                ds=dregion.ds,
+                ds_attributes=ds_attributes,
+                fields=fields,
+                values=values,
+                comm=comm,
+                partition=partition,
+                cull=cull,
+                do_ghost=do_ghost,
+                bounds_files=bounds_files,
+                n_halo=get_smooth_halo(smooth),
+                level_aware=level_aware,
+            )
 
             comm.barrier()
-            # gather and combine
-            all_verts = comm.gather(verts_np, root=0)
-            all_faces = comm.gather(faces_np, root=0)
-            all_samples = comm.gather(samples_np, root=0)
+            meshes, new_bounds, bytes_read, local_stats = extract_grid_surfaces(
+                index=index,
+                grid_ids=grid_ids,
+                fields=fields,
+                values=values,
+                brackets=brackets,
+                bounds=bounds,
+                ds_attributes=ds_attributes,
+                do_ghost=do_ghost,
+                do_gradient=do_gradient,
+                level_boxes=(
+                    get_level_boxes(dregion.ds)
+                    if (do_ghost or smooth) and ghost_fill == "neighbor"
+                    else None
+                ),
+                smooth=smooth,
+                iso_edge=iso_edge,
+                boxes=boxes,
+                plotfile=getattr(dregion.ds, "output_dir", None),
+                do_volume=do_volume,
+            )
+
+            # Sum the surface diagnostics over the grids of every rank
+            stats = {}
+            for surface in surfaces:
+                total = np.zeros(2)
+                comm.Reduce(local_stats[surface], total, op=MPI.SUM, root=0)
+                if rank == 0 and do_volume and surface[0] in bounds:
+                    # Grids culled for lying above the value are inside the volume
+                    total[1] += get_culled_volume(
+                        ds=dregion.ds,
+                        field=surface[0],
+                        value=surface[1],
+                        mins=bounds[surface[0]][0],
+                        bracket=brackets[surface],
+                    )
+                stats[surface] = {
+                    "area": total[0],
+                    "volume": total[1] if do_volume else np.nan,
+                }
+
+            # Report the data read on each level across all of the ranks
+            total_read = np.zeros_like(bytes_read)
+            comm.Reduce(bytes_read, total_read, op=MPI.SUM, root=0)
+            if rank == 0:
+                for level, nbytes in enumerate(total_read):
+                    print(f"Level {level}: read {nbytes / 1e6:.2f} MB")
+
+            # Update the sidecar index with the bounds found during this pass
+            all_new_bounds = comm.gather(new_bounds, root=0)
+            if rank == 0 and bounds_files:
+                num_grids = len(index.grids)
+                for field in fields:
+                    mins, maxs = bounds.get(
+                        field, (np.full(num_grids, np.nan), np.full(num_grids, np.nan))
+                    )
+                    for bfield, igrid, gmin, gmax in itertools.chain(*all_new_bounds):
+                        if bfield == field:
+                            mins[igrid], maxs[igrid] = float(gmin), float(gmax)
+                    utils.save_bounds_index(bounds_files[field], dregion.ds, mins, maxs)
+
+            for isurf, surface in enumerate(surfaces):
+                # Combine the local pieces with face offsets from a prefix sum
+                verts_np, faces_np, samples_np = combine_meshes(
+                    verts=meshes[surface][0],
+                    faces=meshes[surface][1],
+                    samples=meshes[surface][2],
+                )
+
+                if weld and parallel_write:
+                    # Only the grid boundaries owned by this rank can be merged
+                    verts_np, faces_np, first = weld_vertices(
+                        verts=verts_np, faces=faces_np, tol=weld
+                    )
+                    samples_np = samples_np[first]
+
+                comm.barrier()
+                if parallel_write:
+                    # Each rank writes its slab without gathering to the root
+                    shapes[surface] = write_hdf5_parallel(
+                        verts=verts_np,
+                        samples=samples_np,
+                        faces=faces_np,
+                        field=surface[0],
+                        fname=os.path.join(outpath, f"{fname}.hdf5"),
+                        comm=comm,
+                        group=group[surface],
+                        mode="w" if isurf == 0 else "a",
+                        coord_precision=coord_precision,
+                        compression=compression,
+                        shuffle=shuffle,
+                        quantize=quantize,
+                    )
+                    continue
+
+                # gather and combine
+                all_verts = comm.gather(verts_np, root=0)
+                all_faces = comm.gather(faces_np, root=0)
+                all_samples = comm.gather(samples_np, root=0)
+
+                if rank == 0:
+                    all_verts_np, all_faces_np, all_samples_np = combine_meshes(
+                        verts=all_verts, faces=all_faces, samples=all_samples
+                    )
+
+                    if weld:
+                        all_verts_np, all_faces_np, first = weld_vertices(
+                            verts=all_verts_np, faces=all_faces_np, tol=weld
+                        )
+                        all_samples_np = all_samples_np[first]
+
+                    all_meshes[surface] = (all_verts_np, all_faces_np, all_samples_np)
 
             # Barrier before writing
             comm.barrier()
-            if rank == 0:
-                all_verts_np = np.empty((0, 3), dtype=np.float64)
-                all_faces_np = np.empty((0, 3), dtype=np.int32)
-                all_samples_np = np.empty((0), dtype=np.float64)
 
-                for i in range(size):
-                    # offset the face indices by the current length of the array
-                    len_verts, _ = np.shape(all_verts_np)
-                    all_faces[i] += len_verts
+        # Append the step to the series store and mark it as complete
+        if rank == 0 and series_file:
+            with h5py.File(series_file, "a") as f:
+                # Remove any partial step left behind by an interrupted run
+                if step in f:
+                    del f[step]
+
+            for surface in surfaces:
+                all_verts_np, all_faces_np, all_samples_np = all_meshes[surface]
+                write_hdf5(
+                    verts=all_verts_np,
+                    samples=all_samples_np,
+                    faces=all_faces_np,
+                    field=surface[0],
+                    fname=series_file,
+                    group=group[surface],
+                    mode="a",
+                    coord_precision=coord_precision,
+                    # The series store is always compressed
+                    compression=compression or "gzip",
+                    shuffle=shuffle or not compression,
+                    quantize=quantize,
+                )
 
-                    all_verts_np = np.append(all_verts_np, all_verts[i], axis=0)
-                    all_faces_np = np.append(all_faces_np, all_faces[i], axis=0)
-                    all_samples_np = np.append(all_samples_np, all_samples[i], axis=0)
+            with h5py.File(series_file, "a") as f:
+                for field, value in surfaces:
+                    f[group[(field, value)]].attrs.update(
+                        {
+                            "field": field,
+                            "value": value,
+                            "ctype": "Node" if not do_yt else "Cell",
+                        }
+                    )
+                f[step].attrs["time"] = float(ds_attributes["time"])
+                f[step].attrs["complete"] = True
 
         # Write out the hdf5 and the xdmf file
-        if rank == 0:
-            conn_shape, coord_shape, field_shape = write_hdf5(
-                verts=all_verts_np,
-                samples=all_samples_np,
-                faces=all_faces_np,
-                field=field,
-                fname=os.path.join(outpath, f"{fname}.hdf5"),
-            )
+        elif rank == 0:
+            for isurf, surface in enumerate(surfaces):
+                if surface in all_meshes:
+                    all_verts_np, all_faces_np, all_samples_np = all_meshes[surface]
+                    shapes[surface] = write_hdf5(
+                        verts=all_verts_np,
+                        samples=all_samples_np,
+                        faces=all_faces_np,
+                        field=surface[0],
+                        fname=os.path.join(outpath, f"{fname}.hdf5"),
+                        group=group[surface],
+                        mode="w" if isurf == 0 else "a",
+                        coord_precision=coord_precision,
+                        compression=compression,
+                        shuffle=shuffle,
+                        quantize=quantize,
+                    )
 
-            write_xdmf(
+            grids = [
+                get_xdmf_grid(
+                    fhdf5=fname,
+                    field=field,
+                    ftype="Scalar",
+                    ctype="Node" if not do_yt else "Cell",
+                    value=value,
+                    time=ds_attributes["time"],
+                    conn_shape=shapes[(field, value)][0],
+                    coord_shape=shapes[(field, value)][1],
+                    field_shape=shapes[(field, value)][2],
+                    group=group[(field, value)],
+                    name="isoSurface" if len(surfaces) == 1 else f"{field}_{value}",
+                    indent=2 if len(surfaces) == 1 else 3,
+                    coord_precision=coord_precision,
+                )
+                for field, value in surfaces
+            ]
+            write_xdmf_file(
                 fbase=os.path.join(outpath, fname),
-                fhdf5=fname,
-                field=field,
-                ftype="Scalar",
-                ctype="Node" if not do_yt else "Cell",
-                value=value,
-                time=ds_attributes["time"],
-                conn_shape=conn_shape,
-                coord_shape=coord_shape,
-                field_shape=field_shape,
+                body=(
+                    grids[0]
+                    if len(surfaces) == 1
+                    else get_xdmf_collection(grids, name="isoSurfaces")
+                ),
             )
 
     else:
         sys.exit(f"Format {outformat} not in [ply, obj, hdf5, xdmf]")
 
+    return stats
+
+
+def get_edge_mask(origin, dds, shape, iso_edge):
+    """Mask the cells with centers inside of the iso_edge box."""
+    mask = np.ones(shape, dtype=bool)
+    for dim in range(3):
+        centers = origin[dim] + dds[dim] * np.arange(shape[dim])
+        inside = (centers >= iso_edge[dim]) & (centers <= iso_edge[dim + 3])
+        mask &= inside.reshape([-1 if d == dim else 1 for d in range(3)])
+
+    return mask
+
+
+def get_smooth_halo(smooth, truncate=4.0):
+    """Get the number of ghost zones covering the gaussian smoothing kernel."""
+    return int(truncate * float(smooth) + 0.5) if smooth else 0
+
+
+def pad_mask(mask, pad_left, pad_right):
+    """Pad a boolean mask with False on each side in a single allocation."""
+    return np.pad(
+        mask,
+        list(zip(pad_left, pad_right)),
+        mode="constant",
+        constant_values=False,
+    )
+
+
+def get_level_boxes(ds):
+    """Get the integer index boxes of the grids on each level."""
+    index = ds.index
+    grid_levels = index.grid_levels.ravel()
+
+    level_boxes = {}
+    for level in range(index.max_level + 1):
+        ids = np.where(grid_levels == level)[0]
+        dds = ds.domain_width / (ds.domain_dimensions * ds.refine_by**level)
+        lo = np.rint(
+            np.asarray((index.grid_left_edge[ids] - ds.domain_left_edge) / dds)
+        ).astype(np.int64)
+        hi = lo + index.grid_dimensions[ids]
+        level_boxes[level] = (ids, lo, hi)
+
+    return level_boxes
+
+
+def fill_ghost_zones(cube, field, lo, hi, level_boxes, cache, cache_size=64):
+    """Assemble the field on an index box from same-level neighboring grids."""
+    ids, grid_lo, grid_hi = level_boxes[cube.Level]
+    if cache is None:
+        cache = OrderedDict()
+
+    data = np.empty(hi - lo, dtype=np.float64)
+    covered = np.zeros(hi - lo, dtype=bool)
+
+    # Copy the overlapping part of every same-level grid into the box
+    overlap = np.all((grid_lo < hi) & (grid_hi > lo), axis=1)
+    for igrid, nlo, nhi in zip(ids[overlap], grid_lo[overlap], grid_hi[overlap]):
+        key = (field, igrid)
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            grid = cube.index.grids[igrid]
+            cache[key] = np.array(grid[field], dtype=np.float64)
+            grid.clear_data()
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+
+        olo = np.maximum(lo, nlo)
+        ohi = np.minimum(hi, nhi)
+        dst = tuple(slice(a, b) for a, b in zip(olo - lo, ohi - lo))
+        src = tuple(slice(a, b) for a, b in zip(olo - nlo, ohi - nlo))
+        data[dst] = cache[key][src]
+        covered[dst] = True
+
+    # Ghost cells at a coarse-fine boundary have no same-level data
+    if not covered.all():
+        return None
+
+    return data
+
 
 def retrieve_ghost_zones(
     cube,
@@ -331,100 +1209,56 @@ def retrieve_ghost_zones(
     fields,
     ds_left_edge,
     ds_right_edge,
-    single_level,
     do_gradient,
+    level_boxes=None,
+    cache=None,
 ):
-
+    """Get the field and child mask of a grid padded with ghost zones."""
     # Get the cube index information
     start_idx = cube.get_global_startindex()
     act_dims = cube.ActiveDimensions
 
-    child_mask = cube.child_mask
-
-    # Define the left and right physical edges we are trying to access
-    left_phys = ds_left_edge + (start_idx - n_zones) * cube.dds
-    right_phys = left_phys + (act_dims + 2 * n_zones) * cube.dds
+    # Get the number of cells across the domain on this level
+    domain_dims = np.rint(np.asarray((ds_right_edge - ds_left_edge) / cube.dds))
 
-    # Get the conditional array to determine which boundary we might cross
-    left_cond = left_phys <= ds_left_edge
-    right_cond = right_phys >= ds_right_edge
-
-    # Define the new left edge and new dimensions of the box we want
-    nl = start_idx - n_zones * np.invert(left_cond)
+    # Define the new left edge and new dimensions of the box clipped to the domain
+    nl = np.maximum(start_idx - n_zones, 0)
+    nr = np.minimum(start_idx + act_dims + n_zones, domain_dims.astype(np.int64))
     new_left_edge = nl * cube.dds + ds_left_edge
-    new_dims = (
-        act_dims + n_zones * np.invert(left_cond) + n_zones * np.invert(right_cond)
-    )
+    new_dims = nr - nl
 
-    # Append values to the child mask
+    # Pad the child mask with the ghost zones
     add_left_side = start_idx - nl
     add_right_side = (new_dims - act_dims) - add_left_side
+    child_mask = pad_mask(cube.child_mask, add_left_side, add_right_side)
+
+    # Try to fill the ghost zones from the neighboring grids on the same level
+    if level_boxes is not None:
+        data = fill_ghost_zones(
+            cube=cube,
+            field=fields,
+            lo=np.asarray(nl, dtype=np.int64),
+            hi=np.asarray(nl + new_dims, dtype=np.int64),
+            level_boxes=level_boxes,
+            cache=cache,
+        )
+        if data is not None:
+            origin = np.array(new_left_edge + 0.5 * cube.dds)
+            return data, child_mask, np.array(cube.dds), origin
 
-    child_mask = np.append(
-        np.full(
-            (add_left_side[0], np.shape(child_mask)[1], np.shape(child_mask)[2]),
-            False,
-            dtype=bool,
-        ),
-        child_mask,
-        axis=0,
-    )
-    child_mask = np.append(
-        np.full(
-            (np.shape(child_mask)[0], add_left_side[1], np.shape(child_mask)[2]),
-            False,
-            dtype=bool,
-        ),
-        child_mask,
-        axis=1,
-    )
-    child_mask = np.append(
-        np.full(
-            (np.shape(child_mask)[0], np.shape(child_mask)[1], add_left_side[2]),
-            False,
-            dtype=bool,
-        ),
-        child_mask,
-        axis=2,
-    )
-
-    child_mask = np.append(
-        child_mask,
-        np.full(
-            (add_right_side[0], np.shape(child_mask)[1], np.shape(child_mask)[2]),
-            False,
-            dtype=bool,
-        ),
-        axis=0,
-    )
-    child_mask = np.append(
-        child_mask,
-        np.full(
-            (np.shape(child_mask)[0], add_right_side[1], np.shape(child_mask)[2]),
-            False,
-            dtype=bool,
-        ),
-        axis=1,
-    )
-    child_mask = np.append(
-        child_mask,
-        np.full(
-            (np.shape(child_mask)[0], np.shape(child_mask)[1], add_right_side[2]),
-            False,
-            dtype=bool,
-        ),
-        axis=2,
-    )
-
-    # Get the new cube that defined by the new covering grid
+    # Get the new cube on the level of the grid so it lines up with the grid cells
     cube = cube.ds.covering_grid(
-        level=cube.Level if single_level else cube.index.max_level,
+        level=cube.Level,
         left_edge=new_left_edge,
         dims=new_dims,
         num_ghost_zones=n_zones if do_gradient else 0,
     )
+    data = np.array(cube[fields], dtype=np.float64)
+    origin = np.array(cube.left_edge + 0.5 * cube.dds)
+    dds = np.array(cube.dds)
+    cube.clear_data()
 
-    return cube, child_mask
+    return data, child_mask, dds, origin
 
 
 def main():
@@ -437,13 +1271,13 @@ def main():
     args = get_args(parser)
 
     # Create the output directory
+    if args["outpath"]:
+        outpath = args["outpath"]
+    else:
+        outpath = os.path.abspath(
+            os.path.join(sys.argv[0], "../../outdata", "isosurfaces")
+        )
     if rank == 0:
-        if args["outpath"]:
-            outpath = args["outpath"]
-        else:
-            outpath = os.path.abspath(
-                os.path.join(sys.argv[0], "../../outdata", "isosurfaces")
-            )
         os.makedirs(outpath, exist_ok=True)
 
     # Load the plt files
@@ -457,20 +1291,54 @@ def main():
     if args["verbose"]:
         print(f"""The fields in this dataset are: {base_attributes["field_list"]}""")
 
-    comm.Barrier()
-    if rank == 0:
-        start_time = time.time()
+    # Split the ranks into groups that each work on their own plt files
+    group_size = min(args["group_size"] or size, size)
+    num_groups = size // group_size
+    color = min(rank // group_size, num_groups - 1)
+    group_comm = comm.Split(color=color, key=rank)
+    group_rank = group_comm.Get_rank()
+    group_size = group_comm.Get_size()
+
+    if args["verbose"] and rank == 0:
+        print(f"Processing {num_groups} plt files at a time across {size} ranks.")
+
+    # Each group appends to its own file of the series store
+    series_file = None
+    done_steps = set()
+    if args["series"]:
+        series_name = (
+            args["series"]
+            if num_groups == 1
+            else f"""{args["series"]}_group{color:03d}"""
+        )
+        series_file = os.path.join(outpath, f"{series_name}.hdf5")
+        # Find the steps already stored to resume an interrupted run
+        if rank == 0:
+            done_steps = get_series_steps(get_series_files(outpath, args["series"]))
+        done_steps = comm.bcast(done_steps, root=0)
 
-    # Loop over the plt files in the data directory
-    for ds in ts:
+    comm.Barrier()
+    start_time = time.time()
+
+    # Loop over the plt files in the data directory assigned to this group
+    num_surfaces = 0
+    stats_rows = []
+    for ids in range(color, len(ts), num_groups):
+        ds = ts[ids]
+        if ds.basename in done_steps:
+            continue
         # Barrier at the start of each ds iteration
-        comm.Barrier()
+        group_comm.Barrier()
 
         # Visualize the gradient field, if requested
         if args["gradient"]:
-            vis_field = utils.get_gradient_field(ds, args["field"], args["gradient"])
+            vis_fields = [
+                utils.get_gradient_field(ds, field, args["gradient"])
+                for field in args["field"]
+            ]
         else:
-            vis_field = args["field"]
+            vis_fields = args["field"]
+        field_names = "_".join(vis_fields)
 
         # Force periodicity for the yt surface extraction routines...
         if args["format"] in ["ply", "obj"] or args["yt"]:
@@ -484,8 +1352,9 @@ def main():
 
         # Export the isosurfaces in specified format
         if args["value"]:
-            fname = f"""isosurface_{vis_field}_{args["value"]}_{ds.basename}"""
-            value = args["value"]
+            values = args["value"]
+            value_names = "_".join(str(value) for value in values)
+            fname = f"isosurface_{field_names}_{value_names}_{ds.basename}"
         elif args["vfunction"]:
             vstime = args["vfunction"][0]
             vetime = args["vfunction"][2]
@@ -500,8 +1369,9 @@ def main():
                 value = vsval + (veval - vsval) * (
                     (ds_time - vstime) / (vetime - vstime)
                 )
-            fname = f"isosurface_{vis_field}_{ds.basename}_vfunction_{value:.2e}"
-            if rank == 0:
+            values = [value]
+            fname = f"isosurface_{field_names}_{ds.basename}_vfunction_{value:.2e}"
+            if group_rank == 0:
                 print(f"""The value at time = {ds_time} is {value}.""")
         else:
             sys.exit("must have either value or vfunction defined!")
@@ -509,32 +1379,95 @@ def main():
         if args["yt"]:
             fname += "_yt"
 
-        do_isosurface_extraction(
+        stats = do_isosurface_extraction(
             dregion=dregion,
             ds_attributes=ds_attributes,
             outformat=args["format"],
-            field=vis_field,
-            value=value,
-            outpath=outpath if rank == 0 else None,
+            fields=vis_fields,
+            values=values,
+            outpath=outpath if group_rank == 0 or args["parallel_write"] else None,
             fname=fname,
-            comm=comm,
-            rank=rank,
-            size=size,
+            comm=group_comm,
+            rank=group_rank,
+            size=group_size,
             do_ghost=args["do_ghost"],
             do_yt=args["yt"],
-            single_level=args["single_level"],
             smooth=args["smooth"],
             ds=ds if args["format"] == "ply" else None,
             iso_edge=args["iso_edge"],
             do_gradient=True if args["gradient"] else False,
+            parallel_write=args["parallel_write"],
+            partition=args["partition"],
+            cull=not args["no_cull"],
+            bounds_files=(
+                {
+                    field: os.path.join(
+                        outpath, f"grid_bounds_{field}_{ds.basename}.npz"
+                    )
+                    for field in vis_fields
+                }
+                if args["bounds_index"]
+                else None
+            ),
+            ghost_fill=args["ghost_fill"],
+            weld=args["weld"],
+            series_file=series_file,
+            step=ds.basename,
+            coord_precision=args["coord_precision"],
+            compression=args["compression"],
+            shuffle=args["shuffle"],
+            quantize=args["quantize"],
+            level_aware=args["level_aware"],
+            do_volume=args["volume"],
         )
-        if rank == 0:
+        num_surfaces += len(vis_fields) * len(values)
+        if group_rank == 0 and stats:
+            for (field, value), surface_stats in stats.items():
+                print(
+                    f"""Surface {field} = {value}: area = {surface_stats["area"]:.6e}"""
+                    + (
+                        f""", volume = {surface_stats["volume"]:.6e}"""
+                        if args["volume"]
+                        else ""
+                    )
+                )
+                if not args["stats"]:
+                    continue
+                stats_rows.append(
+                    {
+                        "time": float(ds_attributes["time"]),
+                        "plt": ds.basename,
+                        "field": field,
+                        "value": value,
+                        **surface_stats,
+                    }
+                )
+        if group_rank == 0:
             print(
                 f"Time to do isosurface extract = {time.time() - start_time} seconds."
             )
 
+    # Count the surfaces from the root of each group
+    total_surfaces = comm.reduce(num_surfaces if group_rank == 0 else 0, root=0)
+    all_stats_rows = comm.gather(stats_rows, root=0)
+    comm.Barrier()
+    if rank == 0 and args["stats"]:
+        rows = list(itertools.chain(*all_stats_rows))
+        if rows:
+            append_stats_table(
+                fname=os.path.join(outpath, f"""{args["stats"]}.pkl"""), rows=rows
+            )
+    if rank == 0 and args["series"]:
+        # Rebuild the temporal collection from every step in the store
+        write_series_xdmf(
+            fbase=os.path.join(outpath, args["series"]),
+            files=get_series_files(outpath, args["series"]),
+        )
+
     if rank == 0:
-        print(f"Elapsed time = {time.time() - start_time} seconds.")
+        elapsed = time.time() - start_time
+        print(f"Elapsed time = {elapsed} seconds.")
+        print(f"Throughput = {total_surfaces / (elapsed / 3600.0):.2f} surfaces/hour.")
 
 
 if __name__ == "__main__":
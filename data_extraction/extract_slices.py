@@ -1,12 +1,14 @@
 """Extracts slices from plot files and saves."""
 
+import hashlib
 import os
 import sys
 
 import numpy as np
-import yt
+from mpi4py import MPI
 
 sys.path.append(os.path.abspath(os.path.join(sys.argv[0], "../../")))
+import ytscripts.slice_store as slice_store  # noqa: E402
 import ytscripts.utilities as utils  # noqa: E402
 import ytscripts.ytargs as ytargs  # noqa: E402
 
@@ -39,10 +41,367 @@ def get_args(parser):
     else:
         args = vars(init_args)
 
+    # Check to see if mutually exclusive arguments are respected
+    if args["amr"] and (args["series"] or args["format"] != "npy"):
+        raise ValueError('"amr" can only be used with the "npy" format.')
+    if args["off_axis"] and (args["amr"] or args["format"] != "npy"):
+        raise ValueError('"off_axis" can only be used with the "npy" format.')
+
+    # Allow a single field to be given in the input file
+    if args["field"] is not None and not isinstance(args["field"], list):
+        args["field"] = [args["field"]]
+
     # Return the parsed arguments as a dict
     return args
 
 
+def get_plane_axes(normal):
+    """Get the normal axis and the horizontal and vertical axes of the plane."""
+    axes = {"x": (0, 1, 2), "y": (1, 0, 2), "z": (2, 0, 1)}
+    if normal not in axes:
+        raise ValueError(f"Normal {normal} not in: [x, y, z]")
+
+    return axes[normal]
+
+
+def extract_amr_slices(ds, fields, normal, locs, ds_attributes):
+    """Extract every plane along the normal as native AMR patches in one sweep."""
+    inorm, ihor, iver = get_plane_axes(normal)
+    index = ds.index
+    locs = np.asarray(locs, dtype=np.float64)
+    left_edge = np.asarray(ds_attributes["left_edge"])
+
+    # Each patch is (level, lo_h, lo_v, n_h, n_v, offset) into the flat data
+    patches = [[] for _ in locs]
+    data = [{field: [] for field in fields} for _ in locs]
+    fcoords = [[] for _ in locs]
+    offsets = np.zeros(len(locs), dtype=np.int64)
+
+    # Sweep from coarse to fine so the finer patches come after the covered ones
+    for igrid in np.argsort(np.asarray(index.grid_levels).ravel(), kind="stable"):
+        g = index.grids[igrid]
+        g_left = np.asarray(g.LeftEdge)
+        g_dds = np.asarray(g.dds)
+        dims = np.asarray(g.ActiveDimensions)
+
+        # Find the cell layer of the grid containing each plane
+        layers = np.floor((locs - g_left[inorm]) / g_dds[inorm]).astype(np.int64)
+        planes = np.where((layers >= 0) & (layers < dims[inorm]))[0]
+        if len(planes) == 0:
+            continue
+
+        # Read the grid once for all of the planes crossing it
+        grid_data = {field: np.asarray(g[field]) for field in fields}
+        child_mask = np.asarray(g.child_mask)
+        g.clear_data()
+
+        # Index of the first cell of the grid on its own level
+        start = np.rint((g_left - left_edge) / g_dds).astype(np.int64)
+
+        for iplane in planes:
+            # Skip the patches fully covered by finer grids on this plane
+            mask = np.take(child_mask, layers[iplane], axis=inorm)
+            if not mask.any():
+                continue
+
+            for field in fields:
+                layer = np.take(grid_data[field], layers[iplane], axis=inorm)
+                data[iplane][field].append(layer.T.ravel())
+            patches[iplane].append(
+                (
+                    g.Level,
+                    start[ihor],
+                    start[iver],
+                    dims[ihor],
+                    dims[iver],
+                    offsets[iplane],
+                )
+            )
+            offsets[iplane] += dims[ihor] * dims[iver]
+
+            # Keep the centers of the uncovered cells on the plane
+            ihor_cells, iver_cells = np.nonzero(mask)
+            coords = np.empty((len(ihor_cells), 3))
+            coords[:, inorm] = g_left[inorm] + (layers[iplane] + 0.5) * g_dds[inorm]
+            coords[:, ihor] = g_left[ihor] + (ihor_cells + 0.5) * g_dds[ihor]
+            coords[:, iver] = g_left[iver] + (iver_cells + 0.5) * g_dds[iver]
+            fcoords[iplane].append(coords)
+
+    patches = [np.array(patch, dtype=np.int64).reshape(-1, 6) for patch in patches]
+    data = [
+        {
+            field: np.concatenate(values) if values else np.empty(0)
+            for field, values in plane.items()
+        }
+        for plane in data
+    ]
+    fcoords = [
+        np.concatenate(coords) if coords else np.empty((0, 3)) for coords in fcoords
+    ]
+
+    return patches, data, fcoords
+
+
+def extract_batch_slices(ds, fields, normal, locs, ds_attributes):
+    """Extract every plane along the normal in one sweep over the grids."""
+    _, ihor, iver = get_plane_axes(normal)
+    patches, data, fcoords = extract_amr_slices(
+        ds=ds, fields=fields, normal=normal, locs=locs, ds_attributes=ds_attributes
+    )
+
+    # Every plane is stored at the resolution of the finest level
+    dims = np.asarray(ds_attributes["dimensions"])
+    slices = [
+        {
+            field: slice_store.resample_patches(
+                patches=plane_patches,
+                data=plane_data[field],
+                shape=(dims[iver], dims[ihor]),
+                level=ds_attributes["max_level"],
+            )
+            for field in fields
+        }
+        for plane_patches, plane_data in zip(patches, data)
+    ]
+
+    return slices, fcoords
+
+
+def get_off_axis_basis(normal, north=None):
+    """Get the unit normal and the east and north vectors of an off-axis plane."""
+    normal = np.asarray(normal, dtype=np.float64)
+    normal /= np.linalg.norm(normal)
+
+    # Orient the plane like the closest of the x, y and z slices by default
+    if north is None:
+        north = np.eye(3)[(np.argmax(np.abs(normal)) + 2) % 3]
+    north = np.asarray(north, dtype=np.float64)
+    north = north - np.dot(north, normal) * normal
+    if np.linalg.norm(north) == 0.0:
+        raise ValueError("North vector cannot be parallel to the normal.")
+    north /= np.linalg.norm(north)
+    east = np.cross(north, normal)
+
+    return normal, east, north
+
+
+def get_box_corners(left_edge, right_edge):
+    """Get the eight corners of a box."""
+    return np.stack(
+        np.meshgrid(*zip(left_edge, right_edge), indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+
+
+def get_hierarchy_key(ds):
+    """Get a key that changes whenever the grid structure does."""
+    index = ds.index
+    key = hashlib.sha1()
+    for array in [index.grid_levels, index.grid_left_edge, index.grid_dimensions]:
+        key.update(np.ascontiguousarray(array).tobytes())
+
+    return key.hexdigest()
+
+
+def get_off_axis_geometry(ds, normal, north, locs, ds_attributes):
+    """Map the pixels of every off-axis plane to the finest cell containing them."""
+    normal, east, north = get_off_axis_basis(normal, north)
+    index = ds.index
+    locs = np.asarray(locs, dtype=np.float64)
+    left_edge = np.asarray(ds_attributes["left_edge"])
+    right_edge = np.asarray(ds_attributes["right_edge"])
+    center = 0.5 * (left_edge + right_edge)
+
+    # Cover the projection of the domain with pixels of the finest cell size
+    corners = get_box_corners(left_edge, right_edge)
+    proj_h = (corners - center) @ east
+    proj_v = (corners - center) @ north
+    extent = np.array([proj_h.min(), proj_h.max(), proj_v.min(), proj_v.max()])
+    dx = (
+        min(float(dx) for dx in ds_attributes["dxyz"]) / 2 ** ds_attributes["max_level"]
+    )
+    shape = (
+        int(np.ceil((extent[3] - extent[2]) / dx)),
+        int(np.ceil((extent[1] - extent[0]) / dx)),
+    )
+    pix_h = extent[0] + (np.arange(shape[1]) + 0.5) * (extent[1] - extent[0]) / shape[1]
+    pix_v = extent[2] + (np.arange(shape[0]) + 0.5) * (extent[3] - extent[2]) / shape[0]
+    in_plane = center + pix_v[:, None, None] * north + pix_h[None, :, None] * east
+
+    # Owning grid and cell of each pixel, filled from coarse to fine levels
+    num_pixels = shape[0] * shape[1]
+    owner = np.full(len(locs) * num_pixels, -1, dtype=np.int64)
+    cells = np.zeros(len(locs) * num_pixels, dtype=np.int64)
+    for igrid in np.argsort(np.asarray(index.grid_levels).ravel(), kind="stable"):
+        g = index.grids[igrid]
+        g_left = np.asarray(g.LeftEdge)
+        g_right = np.asarray(g.RightEdge)
+        g_dds = np.asarray(g.dds)
+        dims = np.asarray(g.ActiveDimensions)
+
+        # Skip the planes that do not cut through the grid
+        g_corners = get_box_corners(g_left, g_right)
+        dist = (g_corners - center) @ normal
+        planes = np.where((locs >= dist.min()) & (locs <= dist.max()))[0]
+        if len(planes) == 0:
+            continue
+
+        # Only test the pixels under the projection of the grid
+        g_h = (g_corners - center) @ east
+        g_v = (g_corners - center) @ north
+        h_range = np.searchsorted(pix_h, [g_h.min(), g_h.max()])
+        v_range = np.searchsorted(pix_v, [g_v.min(), g_v.max()])
+        if h_range[0] == h_range[1] or v_range[0] == v_range[1]:
+            continue
+        sub = in_plane[v_range[0] : v_range[1], h_range[0] : h_range[1]]
+        pix = (
+            np.arange(v_range[0], v_range[1])[:, None] * shape[1]
+            + np.arange(h_range[0], h_range[1])[None, :]
+        ).ravel()
+
+        for iplane in planes:
+            points = (sub + locs[iplane] * normal).reshape(-1, 3)
+            inside = np.all((points >= g_left) & (points < g_right), axis=1)
+            if not inside.any():
+                continue
+            ijk = np.minimum(
+                ((points[inside] - g_left) / g_dds).astype(np.int64), dims - 1
+            )
+            flat = iplane * num_pixels + pix[inside]
+            owner[flat] = igrid
+            cells[flat] = np.ravel_multi_index(ijk.T, dims)
+
+    # Group the pixels by the grid they are read from
+    pixels = np.flatnonzero(owner >= 0)
+    pixels = pixels[np.argsort(owner[pixels], kind="stable")]
+    grids, starts = np.unique(owner[pixels], return_index=True)
+    reads = [
+        (igrid, pix, cells[pix])
+        for igrid, pix in zip(grids, np.split(pixels, starts[1:]))
+    ]
+
+    # Keep the coordinates of the pixels inside the domain on each plane
+    filled = (owner >= 0).reshape(len(locs), -1)
+    fcoords = [
+        (in_plane + loc * normal).reshape(-1, 3)[filled[iplane]]
+        for iplane, loc in enumerate(locs)
+    ]
+
+    return {
+        "key": get_hierarchy_key(ds),
+        "normal": normal,
+        "east": east,
+        "north": north,
+        "center": center,
+        "extent": extent,
+        "shape": shape,
+        "reads": reads,
+        "fcoords": fcoords,
+    }
+
+
+def extract_off_axis_slices(ds, fields, geometry):
+    """Extract every off-axis plane by reading each mapped grid once."""
+    num_planes = len(geometry["fcoords"])
+    images = {
+        field: np.full((num_planes,) + geometry["shape"], np.nan) for field in fields
+    }
+
+    for igrid, pix, cells in geometry["reads"]:
+        g = ds.index.grids[igrid]
+        for field in fields:
+            images[field].reshape(-1)[pix] = np.asarray(g[field]).reshape(-1)[cells]
+        g.clear_data()
+
+    slices = [
+        {field: images[field][iplane] for field in fields}
+        for iplane in range(num_planes)
+    ]
+
+    return slices, geometry["fcoords"]
+
+
+def extract_slice(ds, fields, normal, iloc, ds_attributes):
+    """Extract one plane of every field through a single region and FRB."""
+    inorm, ihor, iver = get_plane_axes(normal)
+    region = [slice(None)] * 3
+    region[inorm] = iloc
+
+    # Create slice and fixed resolution close to the location
+    slc = ds.r[tuple(region)]
+    frb = slc.to_frb(
+        width=ds_attributes["width"][ihor],
+        height=ds_attributes["width"][iver],
+        resolution=(
+            ds_attributes["resolution"][ihor],
+            ds_attributes["resolution"][iver],
+        ),
+    )
+
+    # Read every variable requested in one pass and pixelize with one buffer
+    slc.get_data(fields)
+    slices = {}
+    for field in fields:
+        slices[field] = frb[field]
+
+    return slices, slc.fcoords
+
+
+def create_task_counter(comm):
+    """Create a counter on the root rank that every rank can increment."""
+    itemsize = MPI.INT64_T.Get_size()
+    counter = MPI.Win.Allocate(
+        itemsize if comm.Get_rank() == 0 else 0, itemsize, comm=comm
+    )
+    if comm.Get_rank() == 0:
+        counter.Lock(0)
+        counter.Put(np.zeros(1, dtype=np.int64), 0)
+        counter.Unlock(0)
+    comm.Barrier()
+
+    return counter
+
+
+def get_next_task(counter):
+    """Atomically take the next task index from the shared counter."""
+    task = np.zeros(1, dtype=np.int64)
+    counter.Lock(0, MPI.LOCK_SHARED)
+    counter.Fetch_and_op(np.ones(1, dtype=np.int64), task, 0, 0, MPI.SUM)
+    counter.Unlock(0)
+
+    return int(task[0])
+
+
+def save_slice(fbase, outformat, slices, fcoords, normal, iloc, ds_attributes):
+    """Save a slice as .npy files with a json sidecar or as a pickled npz."""
+    if outformat == "npy":
+        slice_store.save_slices(
+            fbase=fbase,
+            slices=slices,
+            fcoords=fcoords,
+            normal=normal,
+            iloc=iloc,
+            ds_attributes=ds_attributes,
+        )
+    elif outformat == "npz":
+        np.savez(
+            f"{fbase}.npz",
+            fcoords=fcoords,
+            normal=normal,
+            iloc=iloc,
+            fields=list(slices.keys()),
+            slices=slices,
+            ds_attributes=ds_attributes,
+        )
+    else:
+        raise ValueError(f"Format {outformat} not in: [npy, npz]")
+
+
+def get_time(ds_attributes):
+    """Get the time of the dataset in seconds."""
+    time = ds_attributes["time"]
+    return float(time.in_units("s")) if hasattr(time, "in_units") else float(time)
+
+
 def main():
 
     # Parse the input arguments
@@ -75,83 +434,159 @@ def main():
     # Create the slice array and find indices closest to value
     islice = np.linspace(args["min"], args["max"], args["num_slices"])
 
-    # Loop over the plt files in the data directory
-    yt.enable_parallelism()
-    for ds in ts.piter(dynamic=True):
+    # Append every plot file to one slice series store
+    if args["series"]:
+        series_file = os.path.join(outpath, f"""{args["series"]}.hdf5""")
 
-        if args["field"]:
-            vis_field = args["field"]
-        else:
-            vis_field = None
+    # Hand out every (plot file, plane) pair as a task from a shared counter
+    comm = MPI.COMM_WORLD
+    per_file = args["batch"] or args["amr"] or args["off_axis"]
+    tasks = [
+        (ifile, iplane)
+        for ifile in range(len(ts))
+        for iplane in ([None] if per_file else range(len(islice)))
+    ]
+    locs = islice + args["grid_offset"]
+    counter = create_task_counter(comm)
 
-        # Visualize the gradient field, if requested
-        if args["gradient"]:
-            vis_field = utils.get_gradient_field(ds, args["field"], args["gradient"])
-        else:
-            vis_field = args["field"]
-
-        # Get updated attributes for current plt file
-        ds_attributes = utils.get_attributes(ds=ds)
-
-        # Set index according to dict
-        index = index_dict[str(ds)]
-
-        # for xind in xindices:
-        for iloc in islice:
-            # Do a grid offset if requested
-            iloc += args["grid_offset"]
-            # Create slice and fixed resolution close to the location
-            if args["normal"] == "x":
-                slc = ds.r[iloc, :, :]
-                frb = slc.to_frb(
-                    width=ds_attributes["width"][1],
-                    height=ds_attributes["width"][2],
-                    resolution=(
-                        ds_attributes["resolution"][1],
-                        ds_attributes["resolution"][2],
+    # Off-axis planes are labeled by their distance from the domain center
+    normal = "off" if args["off_axis"] else args["normal"]
+
+    current = None
+    geometry = None
+    while True:
+        itask = get_next_task(counter)
+        if itask >= len(tasks):
+            break
+        ifile, iplane = tasks[itask]
+
+        # Only reload the plot file when the task moves on to a new one
+        if ifile != current:
+            current = ifile
+            ds = ts[ifile]
+
+            # Visualize the gradient field, if requested
+            if args["gradient"]:
+                vis_fields = [
+                    utils.get_gradient_field(ds, field, args["gradient"])
+                    for field in args["field"]
+                ]
+            else:
+                vis_fields = args["field"]
+            field_names = "_".join(vis_fields)
+
+            # Get updated attributes for current plt file
+            ds_attributes = utils.get_attributes(ds=ds)
+
+            # Set index according to dict
+            index = index_dict[str(ds)]
+
+        if args["amr"]:
+            # Keep every plane as the native patches of each level
+            _, ihor, iver = get_plane_axes(args["normal"])
+            dims = np.asarray(ds_attributes["dimensions"])
+            all_patches, all_data, all_fcoords = extract_amr_slices(
+                ds=ds,
+                fields=vis_fields,
+                normal=args["normal"],
+                locs=locs,
+                ds_attributes=ds_attributes,
+            )
+            for iloc, patches, data, fcoords in zip(
+                locs, all_patches, all_data, all_fcoords
+            ):
+                slice_store.save_amr_slices(
+                    fbase=os.path.join(
+                        outpath, f"""{field_names}_{args["normal"]}{iloc:.4f}_{index}"""
                     ),
+                    patches=patches,
+                    data=data,
+                    shape=(dims[iver], dims[ihor]),
+                    fcoords=fcoords,
+                    normal=args["normal"],
+                    iloc=iloc,
+                    ds_attributes=ds_attributes,
                 )
-            elif args["normal"] == "y":
-                slc = ds.r[:, iloc, :]
-                frb = slc.to_frb(
-                    width=ds_attributes["width"][0],
-                    height=ds_attributes["width"][2],
-                    resolution=(
-                        ds_attributes["resolution"][0],
-                        ds_attributes["resolution"][2],
-                    ),
+            continue
+
+        if args["off_axis"]:
+            # Reuse the pixel to cell mapping while the grids are unchanged
+            if geometry is None or geometry["key"] != get_hierarchy_key(ds):
+                geometry = get_off_axis_geometry(
+                    ds=ds,
+                    normal=args["off_axis"],
+                    north=args["north"],
+                    locs=locs,
+                    ds_attributes=ds_attributes,
                 )
-            elif args["normal"] == "z":
-                slc = ds.r[:, :, iloc]
-                frb = slc.to_frb(
-                    width=ds_attributes["width"][0],
-                    height=ds_attributes["width"][1],
-                    resolution=(
-                        ds_attributes["resolution"][0],
-                        ds_attributes["resolution"][1],
-                    ),
+            planes = list(range(len(locs)))
+            all_slices, all_fcoords = extract_off_axis_slices(
+                ds=ds, fields=vis_fields, geometry=geometry
+            )
+        elif args["batch"]:
+            # Fill all of the planes from a single pass over the grids
+            planes = list(range(len(locs)))
+            all_slices, all_fcoords = extract_batch_slices(
+                ds=ds,
+                fields=vis_fields,
+                normal=args["normal"],
+                locs=locs,
+                ds_attributes=ds_attributes,
+            )
+        else:
+            planes = [iplane]
+            slices, fcoords = extract_slice(
+                ds=ds,
+                fields=vis_fields,
+                normal=args["normal"],
+                iloc=locs[iplane],
+                ds_attributes=ds_attributes,
+            )
+            all_slices, all_fcoords = [slices], [fcoords]
+
+        if args["series"]:
+            slice_store.append_slice_series(
+                fname=series_file,
+                index=index,
+                time=get_time(ds_attributes),
+                plt=ds.basename,
+                normal=geometry["normal"] if args["off_axis"] else args["normal"],
+                locs=locs,
+                slices=all_slices,
+                planes=planes,
+            )
+            continue
+
+        # Save the slices to the output directory
+        for iplane, slices, fcoords in zip(planes, all_slices, all_fcoords):
+            iloc = locs[iplane]
+            fbase = os.path.join(outpath, f"{field_names}_{normal}{iloc:.4f}_{index}")
+            if args["off_axis"]:
+                slice_store.save_off_axis_slices(
+                    fbase=fbase,
+                    slices=slices,
+                    fcoords=fcoords,
+                    normal=geometry["normal"],
+                    east=geometry["east"],
+                    north=geometry["north"],
+                    center=geometry["center"],
+                    extent=geometry["extent"],
+                    iloc=iloc,
+                    ds_attributes=ds_attributes,
                 )
-            else:
-                raise ValueError(f"""Normal {args["normal"]} not in: [x, y, z]""")
-
-            # Extract the variable requested
-            slices = {}
-            slices[vis_field] = frb[vis_field]
-            fields = vis_field
-
-            # Save the slice to the output directory
-            np.savez(
-                os.path.join(
-                    outpath, f"""{vis_field}_{args["normal"]}{iloc:.4f}_{index}.npz"""
-                ),
-                fcoords=slc.fcoords,
+                continue
+            save_slice(
+                fbase=fbase,
+                outformat=args["format"],
+                slices=slices,
+                fcoords=fcoords,
                 normal=args["normal"],
                 iloc=iloc,
-                fields=fields,
-                slices=slices,
                 ds_attributes=ds_attributes,
             )
 
+    counter.Free()
+
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,4 @@
-"""Load slices from npz and plot."""
+"""Load slices from the npy store or npz and plot."""
 
 import os
 import sys
@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 sys.path.append(os.path.abspath(os.path.join(sys.argv[0], "../../")))
+import ytscripts.slice_store as slice_store  # noqa: E402
 import ytscripts.utilities as utils  # noqa: E402
 import ytscripts.ytargs as ytargs  # noqa: E402
 
@@ -42,6 +43,39 @@ def get_args(parser):
     return args
 
 
+def load_slice(fname):
+    """Load a slice and its attributes as plain arrays."""
+    if fname.endswith(".json"):
+        data = slice_store.load_slices(fname, mmap_mode="r")
+        ds_attributes = data["ds_attributes"]
+        return {
+            "slices": data["slices"],
+            "fields": data["fields"],
+            "normal": data["normal"],
+            "iloc": data["iloc"],
+            "time": data["time"] * 1e3,
+            "length_units": data["length_units"],
+            "left_edge": np.asarray(ds_attributes["left_edge"]),
+            "right_edge": np.asarray(ds_attributes["right_edge"]),
+            "dxyz": np.asarray(ds_attributes["dxyz"]),
+        }
+
+    # Legacy npz files store the attributes as pickled dicts of unyt objects
+    data = np.load(fname, allow_pickle=True)
+    ds_attributes = data["ds_attributes"][()]
+    return {
+        "slices": data["slices"][()],
+        "fields": data["fields"],
+        "normal": data["normal"],
+        "iloc": data["iloc"],
+        "time": float(ds_attributes["time"].in_units("ms")),
+        "length_units": ds_attributes["length_unit"].units,
+        "left_edge": np.asarray(ds_attributes["left_edge"]),
+        "right_edge": np.asarray(ds_attributes["right_edge"]),
+        "dxyz": np.asarray([float(dx) for dx in ds_attributes["dxyz"]]),
+    }
+
+
 def main():
     # Parse the input arguments
     parser = get_parser()
@@ -55,29 +89,34 @@ def main():
     os.makedirs(imgpath, exist_ok=True)
 
     # Get list of files in the data directory
-    files = np.sort(os.listdir(args["datapath"]))
+    files = np.sort(
+        [
+            fname
+            for fname in os.listdir(args["datapath"])
+            if fname.endswith(".json") or fname.endswith(".npz")
+        ]
+    )
 
     # Loop over files, plot and save images
     index = 0
     for fname in files:
 
         # Load the data
-        data = np.load(os.path.join(args["datapath"], fname), allow_pickle=True)
+        data = load_slice(os.path.join(args["datapath"], fname))
         # Print out the variables in the dataset
         if index == 0 and args["verbose"]:
-            print(f"""The variables contained in this file are: {data.files}""")
+            print(f"""The fields contained in this file are: {data["fields"]}""")
 
         # Unpack the dicts
-        ds_attributes = data["ds_attributes"][()]
-        slices = data["slices"][()]
-        # fields = data["fields"][()]
-        dxyz = ds_attributes["dxyz"]
+        slices = data["slices"]
+        dxyz = data["dxyz"]
+        left_edge = data["left_edge"]
+        right_edge = data["right_edge"]
 
         # Get some variables
         normal = data["normal"]
         iloc = data["iloc"]
-        time = ds_attributes["time"]
-        length_unit = ds_attributes["length_unit"]
+        length_units = data["length_units"]
 
         if args["field"] not in data["fields"]:
             sys.exit(f"""{args["field"]} not in {data["fields"]}""")
@@ -115,12 +154,8 @@ def main():
         cmap = plt.cm.get_cmap(args["cmap"])
 
         if normal == "x":
-            y = np.linspace(
-                ds_attributes["left_edge"][1], ds_attributes["right_edge"][1], xlen
-            )
-            z = np.linspace(
-                ds_attributes["left_edge"][2], ds_attributes["right_edge"][2], ylen
-            )
+            y = np.linspace(left_edge[1], right_edge[1], xlen)
+            z = np.linspace(left_edge[2], right_edge[2], ylen)
             Y, Z = np.meshgrid(y, z, indexing="xy")
             im = ax.pcolormesh(
                 Y,
@@ -130,15 +165,11 @@ def main():
                 vmin=args["fbounds"][0] if args["fbounds"] else None,
                 vmax=args["fbounds"][1] if args["fbounds"] else None,
             )
-            ax.set_xlabel(f"y ({length_unit.units})")
-            ax.set_ylabel(f"z ({length_unit.units})")
+            ax.set_xlabel(f"y ({length_units})")
+            ax.set_ylabel(f"z ({length_units})")
         elif normal == "y":
-            x = np.linspace(
-                ds_attributes["left_edge"][0], ds_attributes["right_edge"][0], xlen
-            )
-            z = np.linspace(
-                ds_attributes["left_edge"][2], ds_attributes["right_edge"][2], ylen
-            )
+            x = np.linspace(left_edge[0], right_edge[0], xlen)
+            z = np.linspace(left_edge[2], right_edge[2], ylen)
             X, Z = np.meshgrid(x, z, indexing="xy")
             im = ax.pcolormesh(
                 X,
@@ -148,15 +179,11 @@ def main():
                 vmin=args["fbounds"][0],
                 vmax=args["fbounds"][1],
             )
-            ax.set_xlabel(f"x ({length_unit.units})")
-            ax.set_ylabel(f"z ({length_unit.units})")
+            ax.set_xlabel(f"x ({length_units})")
+            ax.set_ylabel(f"z ({length_units})")
         elif normal == "z":
-            x = np.linspace(
-                ds_attributes["left_edge"][0], ds_attributes["right_edge"][0], xlen
-            )
-            y = np.linspace(
-                ds_attributes["left_edge"][1], ds_attributes["right_edge"][1], ylen
-            )
+            x = np.linspace(left_edge[0], right_edge[0], xlen)
+            y = np.linspace(left_edge[1], right_edge[1], ylen)
             X, Y = np.meshgrid(x, y, indexing="xy")
             im = ax.pcolormesh(
                 X,
@@ -166,14 +193,14 @@ def main():
                 vmin=args["fbounds"][0],
                 vmax=args["fbounds"][1],
             )
-            ax.set_xlabel(f"x ({length_unit.units})")
-            ax.set_ylabel(f"y ({length_unit.units})")
+            ax.set_xlabel(f"x ({length_units})")
+            ax.set_ylabel(f"y ({length_units})")
         else:
             sys.exit(f"Normal {normal} not in: [x, y, z]")
 
         ax.set_title(
-            f"""{normal} = {iloc:.4f} {length_unit.units}, """
-            f"""time = {float(time.in_units("ms")):.2f} ms"""
+            f"""{normal} = {iloc:.4f} {length_units}, """
+            f"""time = {data["time"]:.2f} ms"""
         )
         if args["pbox"]:
             ax.set_xlim(args["pbox"][0], args["pbox"][2])
@@ -212,22 +212,31 @@ def main():
             )
             slc_res["y"] = (max_res, max_res)
 
+        # Cut the plane along an arbitrary normal vector, if requested
+        if args["off_axis"]:
+            normal = "off"
+            max_res = max(ds_attributes["resolution"])
+            slc_res[normal] = (max_res, max_res)
+            off_axis_kwargs = {"north_vector": args["north"]}
+        else:
+            normal = args["normal"]
+            off_axis_kwargs = {}
+
         # Set index according to dict
         index = index_dict[str(ds)]
 
         # Plot the field
         slc = yt.SlicePlot(
             ds=ds,
-            normal=args["normal"],
+            normal=args["off_axis"] if args["off_axis"] else args["normal"],
             fields=vis_field,
             center=slc_center,
             buff_size=(
-                tuple(args["buff"])
-                if args["buff"] is not None
-                else slc_res[args["normal"]]
+                tuple(args["buff"]) if args["buff"] is not None else slc_res[normal]
             ),
+            **off_axis_kwargs,
         )
-        if args["normal"] == "y":
+        if normal == "y":
             slc.swap_axes()
         slc.set_axes_unit(axes_unit)
         slc.set_origin("native")
@@ -271,7 +280,12 @@ def main():
 
         # Remove the units
         if args["no_units"]:
-            norm_dict = {"x": ["y", "z"], "y": ["x", "z"], "z": ["x", "y"]}
+            norm_dict = {
+                "x": ["y", "z"],
+                "y": ["x", "z"],
+                "z": ["x", "y"],
+                "off": [r"x^\prime", r"y^\prime"],
+            }
             slc.set_colorbar_label(
                 field=vis_field,
                 label=(
@@ -282,8 +296,8 @@ def main():
             )
             # if not configs["cbar_attrs"]["label"]["loc"] == "right":
             # slc.set_colorbar_label(field=vis_field, label="")
-            slc.set_xlabel(f"""${norm_dict[args["normal"]][0]}$""")
-            slc.set_ylabel(f"""${norm_dict[args["normal"]][1]}$""")
+            slc.set_xlabel(f"""${norm_dict[normal][0]}$""")
+            slc.set_ylabel(f"""${norm_dict[normal][1]}$""")
 
         # Override the colorbar label
         if vis_field in configs["vis_field_attrs"] and not args["no_units"]:
@@ -337,6 +351,14 @@ def main():
             dy = (ry - ly) / yres
             dz = (rz - lz) / zres
 
+            # Off-axis images span the plot limits around the center
+            if normal == "off":
+                lh = float(slc.xlim[0].to(axes_unit))
+                lv = float(slc.ylim[0].to(axes_unit))
+                nv, nh = slc.frb.buff_size[::-1]
+                dh = (float(slc.xlim[1].to(axes_unit)) - lh) / nh
+                dv = (float(slc.ylim[1].to(axes_unit)) - lv) / nv
+
             # contour must be a multiple of three arguments
             if not len(args["contour"]) % 3 == 0:
                 sys.exit(
@@ -357,7 +379,16 @@ def main():
                     image=slc.frb[args["contour"][idx]], level=args["contour"][idx + 1]
                 )
 
-                if args["normal"] == "x":
+                if normal == "off":
+                    plot_contours(
+                        contour=contour,
+                        ax=ax,
+                        left_edge=[lh, lv],
+                        dxy=[dh, dv],
+                        color=args["contour"][idx + 2],
+                        linewidth=linewidth,
+                    )
+                elif normal == "x":
                     plot_contours(
                         contour=contour,
                         ax=ax,
@@ -366,7 +397,7 @@ def main():
                         color=args["contour"][idx + 2],
                         linewidth=linewidth,
                     )
-                elif args["normal"] == "y":
+                elif normal == "y":
                     plot_contours(
                         contour=contour,
                         ax=ax,
@@ -375,7 +406,7 @@ def main():
                         color=args["contour"][idx + 2],
                         linewidth=linewidth,
                     )
-                elif args["normal"] == "z":
+                elif normal == "z":
                     plot_contours(
                         contour=contour,
                         ax=ax,
@@ -387,7 +418,7 @@ def main():
                 else:
                     sys.exit(f"""Normal {args["normal"]} is not in [x, y, z]!""")
 
-        plt_fname = f"""{vis_field}_{args["normal"]}_{str(index).zfill(5)}"""
+        plt_fname = f"""{vis_field}_{normal}_{str(index).zfill(5)}"""
 
         # Add grid information to the slice plot
         if args["grid_info"]:
@@ -436,11 +467,18 @@ def main():
                 lx, ly, lz = np.array(ds_attributes["left_edge"])
                 rx, ry, rz = np.array(ds_attributes["right_edge"])
 
-                if args["normal"] == "x":
+                if normal == "off":
+                    extent = [
+                        float(slc.xlim[0].to(axes_unit)),
+                        float(slc.xlim[1].to(axes_unit)),
+                        float(slc.ylim[0].to(axes_unit)),
+                        float(slc.ylim[1].to(axes_unit)),
+                    ]
+                elif normal == "x":
                     extent = [ly, ry, lz, rz]
-                elif args["normal"] == "y":
+                elif normal == "y":
                     extent = [lz, rz, lx, rx]
-                elif args["normal"] == "z":
+                elif normal == "z":
                     extent = [lx, rx, ly, ry]
 
             # TODO: move the default rm_eb function into utils of top of script
@@ -0,0 +1,105 @@
+"""Append-only store of extracted averages keyed by plot file, mtime and time."""
+
+import fcntl
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+
+STORE_COLUMNS = {
+    "plt": h5py.string_dtype(),
+    "mtime": np.float64,
+    "time": np.float64,
+    "column": h5py.string_dtype(),
+    "value": np.float64,
+}
+STRING_COLUMNS = ["plt", "column"]
+
+
+def get_mtime(path):
+    """Get the modification time of a plot file from its header."""
+    header = os.path.join(path, "Header")
+    return os.path.getmtime(header if os.path.exists(header) else path)
+
+
+def read_store(fname):
+    """Read every row of the store into a long table (one row per value)."""
+    if not os.path.exists(fname):
+        return pd.DataFrame({name: [] for name in STORE_COLUMNS}), {}
+
+    with h5py.File(fname, "r") as f:
+        df = pd.DataFrame(
+            {
+                name: f[name].asstr()[:] if name in STRING_COLUMNS else f[name][:]
+                for name in STORE_COLUMNS
+            }
+        )
+        units = dict(f["units"].attrs)
+
+    return df, units
+
+
+def get_current(df):
+    """Keep the latest value of each column from the newest version of each file."""
+    if df.empty:
+        return df
+    newest = df.groupby("plt")["mtime"].transform("max")
+    df = df[df["mtime"] == newest]
+
+    return df.drop_duplicates(subset=["plt", "column"], keep="last")
+
+
+def get_done(fname):
+    """Get the mtime and the stored columns of every plot file in the store."""
+    df = get_current(read_store(fname)[0])
+    return {
+        plt: (group["mtime"].iloc[0], set(group["column"]))
+        for plt, group in df.groupby("plt")
+    }
+
+
+def append_results(fname, plt, mtime, time, values, units):
+    """Append the values of one plot file to the store."""
+    num_rows = len(values)
+    rows = {
+        "plt": [plt] * num_rows,
+        "mtime": np.full(num_rows, mtime),
+        "time": np.full(num_rows, time),
+        "column": list(values.keys()),
+        "value": np.array(list(values.values()), dtype=np.float64),
+    }
+
+    # Ranks working on other plot files append to the same store one at a time
+    with open(f"{fname}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with h5py.File(fname, "a") as f:
+            if "units" not in f:
+                f.create_group("units")
+                for name, dtype in STORE_COLUMNS.items():
+                    f.create_dataset(
+                        name, (0,), maxshape=(None,), chunks=(1024,), dtype=dtype
+                    )
+
+            start = f["plt"].shape[0]
+            for name in STORE_COLUMNS:
+                f[name].resize(start + num_rows, axis=0)
+                f[name][start:] = rows[name]
+            for column, unit in units.items():
+                f["units"].attrs[column] = unit
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def get_results(fname, columns):
+    """Get the latest values of the columns for every plot file, keyed by time."""
+    df, units = read_store(fname)
+    df = get_current(df)
+    df = df[df["column"].isin(columns)]
+
+    # One row per plot file with its time, and one column per statistic
+    times = df.groupby("plt")["time"].last()
+    wide = df.pivot(index="plt", columns="column", values="value")
+    wide = wide.reindex(columns=[column for column in columns if column in wide])
+    wide.index = times.loc[wide.index].to_numpy()
+
+    return wide.to_dict(orient="index"), units
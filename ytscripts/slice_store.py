@@ -0,0 +1,234 @@
+"""Memory-mappable store for extracted slices that can be read without yt."""
+
+import fcntl
+import json
+import os
+
+import h5py
+import numpy as np
+
+
+def to_json(value):
+    """Convert a value, dropping any units, to plain JSON types."""
+    if isinstance(value, dict):
+        return {str(key): to_json(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(val) for val in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return np.asarray(value).tolist()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def get_units(ds_attributes):
+    """Get the units of every attribute that carries them."""
+    units = {}
+    for key, value in ds_attributes.items():
+        if isinstance(value, (list, tuple)) and value:
+            value = value[0]
+        if hasattr(value, "units"):
+            units[key] = str(value.units)
+
+    return units
+
+
+def save_slices(fbase, slices, fcoords, normal, iloc, ds_attributes):
+    """Save each field of a slice to a .npy file with a JSON sidecar."""
+    name = os.path.basename(fbase)
+    files = {}
+    for field, data in slices.items():
+        files[field] = f"{name}_{field}.npy"
+        np.save(f"{fbase}_{field}.npy", np.ascontiguousarray(data, dtype=np.float64))
+    np.save(f"{fbase}_fcoords.npy", np.asarray(fcoords, dtype=np.float64))
+
+    time = ds_attributes["time"]
+    sidecar = {
+        "normal": to_json(normal),
+        "iloc": float(iloc),
+        "time": float(time.in_units("s")) if hasattr(time, "in_units") else time,
+        "length_units": str(getattr(ds_attributes["length_unit"], "units", "")),
+        "fields": list(slices.keys()),
+        "files": files,
+        "fcoords": f"{name}_fcoords.npy",
+        "units": get_units(ds_attributes),
+        "ds_attributes": to_json(ds_attributes),
+    }
+    with open(f"{fbase}.json", "w") as f:
+        json.dump(sidecar, f, indent=2)
+
+
+def save_amr_slices(fbase, patches, data, shape, fcoords, normal, iloc, ds_attributes):
+    """Save the native AMR patches of a slice with a JSON sidecar."""
+    save_slices(
+        fbase=fbase,
+        slices=data,
+        fcoords=fcoords,
+        normal=normal,
+        iloc=iloc,
+        ds_attributes=ds_attributes,
+    )
+    np.save(f"{fbase}_patches.npy", np.asarray(patches, dtype=np.int64))
+
+    # Record the patch table and the shape of the coarsest level in the sidecar
+    with open(f"{fbase}.json", "r") as f:
+        sidecar = json.load(f)
+    sidecar["patches"] = f"{os.path.basename(fbase)}_patches.npy"
+    sidecar["shape"] = [int(n) for n in shape]
+    with open(f"{fbase}.json", "w") as f:
+        json.dump(sidecar, f, indent=2)
+
+
+def save_off_axis_slices(
+    fbase, slices, fcoords, normal, east, north, center, extent, iloc, ds_attributes
+):
+    """Save an off-axis slice with its plane orientation in the JSON sidecar."""
+    save_slices(
+        fbase=fbase,
+        slices=slices,
+        fcoords=fcoords,
+        normal=normal,
+        iloc=iloc,
+        ds_attributes=ds_attributes,
+    )
+
+    # Record the in-plane vectors, the plane origin and the extent of the image
+    with open(f"{fbase}.json", "r") as f:
+        sidecar = json.load(f)
+    sidecar["east"] = to_json(east)
+    sidecar["north"] = to_json(north)
+    sidecar["center"] = to_json(np.asarray(center) + iloc * np.asarray(normal))
+    sidecar["extent"] = to_json(extent)
+    with open(f"{fbase}.json", "w") as f:
+        json.dump(sidecar, f, indent=2)
+
+
+def resample_patches(patches, data, shape, level):
+    """Fill a uniform image on a level from AMR patches, from coarse to fine."""
+    image = np.full((shape[0] * 2**level, shape[1] * 2**level), np.nan)
+
+    for plev, lo_h, lo_v, n_h, n_v, offset in patches[
+        np.argsort(patches[:, 0], kind="stable")
+    ]:
+        patch = np.asarray(data[offset : offset + n_h * n_v]).reshape(n_v, n_h)
+        if plev <= level:
+            # Repeat the coarse cells over the pixels of the finer image
+            ratio = 2 ** (level - plev)
+            patch = np.repeat(np.repeat(patch, ratio, axis=0), ratio, axis=1)
+            lo_v, lo_h = lo_v * ratio, lo_h * ratio
+        else:
+            # Take one fine cell for each pixel of the coarser image
+            ratio = 2 ** (plev - level)
+            start_v, start_h = -lo_v % ratio, -lo_h % ratio
+            patch = patch[start_v::ratio, start_h::ratio]
+            lo_v, lo_h = (lo_v + start_v) // ratio, (lo_h + start_h) // ratio
+
+        image[lo_v : lo_v + patch.shape[0], lo_h : lo_h + patch.shape[1]] = patch
+
+    return image
+
+
+def load_slices(fname, mmap_mode="r", level=None):
+    """Load a slice from its JSON sidecar, mapping the arrays from disk."""
+    with open(fname, "r") as f:
+        data = json.load(f)
+
+    path = os.path.dirname(fname)
+    data["slices"] = {
+        field: np.load(os.path.join(path, sfile), mmap_mode=mmap_mode)
+        for field, sfile in data["files"].items()
+    }
+    data["fcoords"] = np.load(os.path.join(path, data["fcoords"]), mmap_mode=mmap_mode)
+
+    # Resample AMR patches to a uniform image, on the finest level by default
+    if "patches" in data:
+        data["patches"] = np.load(os.path.join(path, data["patches"]))
+        if level is None:
+            level = data["ds_attributes"]["max_level"]
+        data["slices"] = {
+            field: resample_patches(
+                patches=data["patches"], data=values, shape=data["shape"], level=level
+            )
+            for field, values in data["slices"].items()
+        }
+
+    return data
+
+
+def convert_npz(fname, outpath=None):
+    """Convert a pickled npz slice from extract_slices to the .npy store."""
+    outpath = outpath or os.path.dirname(fname)
+    data = np.load(fname, allow_pickle=True)
+    fbase = os.path.join(outpath, os.path.splitext(os.path.basename(fname))[0])
+
+    save_slices(
+        fbase=fbase,
+        slices=data["slices"][()],
+        fcoords=data["fcoords"],
+        normal=data["normal"][()],
+        iloc=data["iloc"][()],
+        ds_attributes=data["ds_attributes"][()],
+    )
+
+    return f"{fbase}.json"
+
+
+def get_series_chunks(shape, time_chunk=16, tile=64):
+    """Get chunks that serve both single frames and single pixel histories."""
+    _, _, ny, nx = shape
+    return (time_chunk, 1, min(tile, ny), min(tile, nx))
+
+
+def append_slice_series(fname, index, time, plt, normal, locs, slices, planes=None):
+    """Write planes of one plot file into a (time, plane, ny, nx) store."""
+    fields = list(slices[0].keys())
+    ny, nx = np.shape(slices[0][fields[0]])
+    num_planes = len(locs)
+    if planes is None:
+        planes = list(range(num_planes))
+
+    # Ranks working on other plot files append to the same store one at a time
+    with open(f"{fname}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with h5py.File(fname, "a") as f:
+            if "time" not in f:
+                f.attrs["normal"] = (
+                    normal if isinstance(normal, str) else np.asarray(normal)
+                )
+                f.create_dataset("locs", data=np.asarray(locs, dtype=np.float64))
+                f.create_dataset(
+                    "time", (0,), maxshape=(None,), dtype=np.float64, fillvalue=np.nan
+                )
+                f.create_dataset(
+                    "plt", (0,), maxshape=(None,), dtype=h5py.string_dtype()
+                )
+                f.create_dataset(
+                    "complete", (0, num_planes), maxshape=(None, num_planes), dtype=bool
+                )
+
+            # Grow the time axis to hold the index of this plot file
+            num_times = max(f["time"].shape[0], index + 1)
+            for name in ["time", "plt", "complete"]:
+                f[name].resize(num_times, axis=0)
+
+            for field in fields:
+                if field not in f:
+                    shape = (num_times, num_planes, ny, nx)
+                    f.create_dataset(
+                        field,
+                        shape,
+                        maxshape=(None, num_planes, ny, nx),
+                        chunks=get_series_chunks(shape),
+                        dtype=np.float64,
+                        fillvalue=np.nan,
+                    )
+                elif f[field].shape[0] < num_times:
+                    f[field].resize(num_times, axis=0)
+
+                for iplane, plane in zip(planes, slices):
+                    f[field][index, iplane] = np.asarray(plane[field], dtype=np.float64)
+
+            f["time"][index] = time
+            f["plt"][index] = plt
+            f["complete"][index, sorted(planes)] = True
+        fcntl.flock(lock, fcntl.LOCK_UN)
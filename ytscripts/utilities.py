@@ -9,9 +9,14 @@ import sys
 import tomllib
 
 import numpy as np
-import yt
 from pydantic.v1.utils import deep_update
 
+try:
+    import yt
+except ImportError:
+    # Reading and plotting the extracted data does not need yt
+    yt = None
+
 
 def is_notebook():
     """Check if the script is running in a Jupyter notebook."""
@@ -67,7 +72,9 @@ def create_index_dict(all_files, plt_files):
     return index_dict
 
 
-def load_dataseries(datapath, pname=None, units_override=None, nprocs=1, nskip=None):
+def load_dataseries(
+    datapath, pname=None, units_override=None, nprocs=1, nskip=None, select=None
+):
     """
     Load a series of datasets from files in a given directory.
 
@@ -78,6 +85,8 @@ def load_dataseries(datapath, pname=None, units_override=None, nprocs=1, nskip=N
     loaded datasets. Default is None.
     - nprocs (int, optional): The number of processes to use for parallel loading.
     - nskip (int, optional): The number of files to skip between loaded datasets.
+    - select (callable, optional): Only load the files for which select(path) is
+    True. Default is None (load all files).
 
     Returns:
     - ts (yt.DatasetSeries): A series of loaded datasets.
@@ -95,6 +104,8 @@ def load_dataseries(datapath, pname=None, units_override=None, nprocs=1, nskip=N
             if nskip:
                 matched_files = matched_files[:: nskip + 1]
             load_list.extend(matched_files)
+        if select is not None:
+            load_list = [f for f in load_list if select(f)]
 
         ts = yt.DatasetSeries(
             load_list,
@@ -115,6 +126,8 @@ def load_dataseries(datapath, pname=None, units_override=None, nprocs=1, nskip=N
             load_files = select_files
 
         load_list = [os.path.join(datapath, x) for x in load_files]
+        if select is not None:
+            load_list = [f for f in load_list if select(f)]
 
         ts = yt.DatasetSeries(
             load_list,
@@ -302,3 +315,264 @@ def compute_elem_mass_fraction(attributes, keys=None):
         elem_mass_frac_dict[spec]["N"] /= total_mass
 
     return elem_mass_frac_dict, atomic_masses, fields
+
+
+def get_field_component(plotfile, field):
+    """Get the component index of a field from an AMReX plot file header."""
+    header = os.path.join(plotfile, "Header")
+    if not os.path.exists(header):
+        return None
+    with open(header, "r") as f:
+        f.readline()
+        nvars = int(f.readline())
+        var_names = [f.readline().strip() for _ in range(nvars)]
+
+    fname = field[1] if isinstance(field, tuple) else field
+    if fname not in var_names:
+        return None
+    return var_names.index(fname)
+
+
+def read_fab_bounds(plotfile, level, field):
+    """Read the per-grid min/max of a field from an AMReX Cell_H header."""
+    # Find the component index of the field from the plot file header
+    icomp = get_field_component(plotfile, field)
+    if icomp is None:
+        return None
+
+    cell_h = os.path.join(plotfile, f"Level_{level}", "Cell_H")
+    if not os.path.exists(cell_h):
+        return None
+    with open(cell_h, "r") as f:
+        lines = [line.strip() for line in f]
+
+    # The min and max blocks each start with a "nfabs,ncomp" line
+    starts = [i for i, line in enumerate(lines) if re.match(r"^\d+,\d+$", line)]
+    if len(starts) < 2:
+        return None
+
+    bounds = []
+    for start in starts[:2]:
+        nfabs = int(lines[start].split(",")[0])
+        bounds.append(
+            np.array(
+                [
+                    float(line.rstrip(",").split(",")[icomp])
+                    for line in lines[start + 1 : start + 1 + nfabs]
+                ]
+            )
+        )
+
+    return bounds[0], bounds[1]
+
+
+def read_fab_index(plotfile, level):
+    """Read the data file and byte offset of every fab on a level."""
+    cell_h = os.path.join(plotfile, f"Level_{level}", "Cell_H")
+    if not os.path.exists(cell_h):
+        return None
+    with open(cell_h, "r") as f:
+        fabs = [line.split()[1:3] for line in f if line.startswith("FabOnDisk:")]
+
+    return [
+        (os.path.join(plotfile, f"Level_{level}", fname), int(offset))
+        for fname, offset in fabs
+    ]
+
+
+def read_fab_box(fab, icomp, lo, hi):
+    """Read a box of one component of an AMReX fab, reading only its z-planes."""
+    fname, offset = fab
+    with open(fname, "rb") as f:
+        f.seek(offset)
+        # FAB ((8, (64 11 52 0 1 12 0 1023)),(8, (8 7 6 5 4 3 2 1)))((lo) (hi) (t)) n
+        header = f.readline().decode("ascii")
+        start = f.tell()
+
+    match = re.match(
+        r"FAB \(\(\d+, \(([\d ]+)\)\),\(\d+, \(([\d ]+)\)\)\)"
+        r"\(\(([-\d,]+)\) \(([-\d,]+)\)",
+        header,
+    )
+    if match is None:
+        return None
+
+    # The first entry of the real format is its size in bits
+    nbytes = int(match.group(1).split()[0]) // 8
+    order = match.group(2).split()
+    if nbytes not in (4, 8) or len(order) != nbytes:
+        return None
+    dtype = np.dtype(f"""{"<" if order[0] != "1" else ">"}f{nbytes}""")
+    fab_lo = np.array([int(i) for i in match.group(3).split(",")])
+    fab_hi = np.array([int(i) for i in match.group(4).split(",")])
+    nx, ny, nz = fab_hi - fab_lo + 1
+
+    # The fab is stored in Fortran order so each z-plane is contiguous
+    lo = np.asarray(lo) - fab_lo
+    hi = np.asarray(hi) - fab_lo
+    count = (hi[2] - lo[2]) * nx * ny
+    data = np.fromfile(
+        fname,
+        dtype=dtype,
+        count=count,
+        offset=start + (icomp * nx * ny * nz + lo[2] * nx * ny) * nbytes,
+    )
+    if data.size != count:
+        return None
+    data = data.reshape((hi[2] - lo[2], ny, nx)).transpose()
+    data = np.array(data[lo[0] : hi[0], lo[1] : hi[1], :], dtype=np.float64)
+
+    return data, count * nbytes
+
+
+def get_grid_bounds(ds, field):
+    """Get the min/max of a field on every grid without reading the grid data."""
+    num_grids = len(ds.index.grids)
+    mins = np.full(num_grids, np.nan)
+    maxs = np.full(num_grids, np.nan)
+
+    grid_levels = ds.index.grid_levels.ravel()
+    for level in range(ds.index.max_level + 1):
+        bounds = read_fab_bounds(getattr(ds, "output_dir", ""), level, field)
+        # Grids are stored in the same order as the fabs on each level
+        idx = np.where(grid_levels == level)[0]
+        if bounds is None or len(bounds[0]) != len(idx):
+            continue
+        mins[idx], maxs[idx] = bounds
+
+    return mins, maxs
+
+
+def get_grid_costs(ds, empty=None, empty_weight=0.25, cells=None):
+    """Estimate the cost of each grid from its cells and the iso value bracket."""
+    if cells is None:
+        cells = np.prod(ds.index.grid_dimensions, axis=1)
+    costs = np.asarray(cells, dtype=np.float64).copy()
+
+    # Grids that cannot contain the surface are only read, not triangulated
+    if empty is not None:
+        costs[empty] *= empty_weight
+
+    return costs
+
+
+def _morton_code(points, nbits=10):
+    """Interleave the bits of quantized 3D points into Morton codes."""
+    ipts = (np.clip(points, 0.0, 1.0) * (2**nbits - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(nbits):
+        for dim in range(3):
+            bits = (ipts[:, dim] >> np.uint64(bit)) & np.uint64(1)
+            codes |= bits << np.uint64(3 * bit + dim)
+
+    return codes
+
+
+def partition_grids(costs, size, method="lpt", centers=None):
+    """Assign grids to ranks and return the grid indices for each rank."""
+    num_grids = len(costs)
+
+    if method == "round_robin":
+        return [np.arange(rank, num_grids, size) for rank in range(size)]
+
+    elif method == "lpt":
+        # Greedy longest processing time: biggest grid to the least loaded rank
+        loads = np.zeros(size)
+        owner = np.empty(num_grids, dtype=np.int64)
+        for igrid in np.argsort(costs, kind="stable")[::-1]:
+            rank = np.argmin(loads)
+            owner[igrid] = rank
+            loads[rank] += costs[igrid]
+
+        return [np.sort(np.where(owner == rank)[0]) for rank in range(size)]
+
+    elif method == "sfc":
+        if centers is None:
+            raise ValueError("Grid centers are needed for sfc partitioning.")
+        if num_grids == 0:
+            return [np.array([], dtype=np.int64) for _ in range(size)]
+        # Order the grids along a Morton curve and cut it into equal cost pieces
+        order = np.argsort(_morton_code(centers), kind="stable")
+        cumulative = np.cumsum(costs[order])
+        targets = cumulative[-1] * np.arange(1, size) / size
+        cuts = np.searchsorted(cumulative, targets, side="right")
+
+        return [np.sort(part) for part in np.split(order, cuts)]
+
+    else:
+        raise ValueError(f"Method {method} not in: [round_robin, lpt, sfc]")
+
+
+def get_partition_stats(costs, parts):
+    """Get statistics of the load on each rank from a grid partition."""
+    loads = np.array([np.sum(costs[part]) for part in parts])
+    mean_load = np.mean(loads)
+
+    return {
+        "min": np.min(loads),
+        "max": np.max(loads),
+        "mean": mean_load,
+        "imbalance": np.max(loads) / mean_load if mean_load > 0 else 1.0,
+        "num_grids": [len(part) for part in parts],
+    }
+
+
+def get_uncovered_boxes(ds):
+    """Get the bounding box of the cells of each grid not covered by finer grids."""
+    boxes = []
+    for grid in ds.index.grids:
+        # The child mask is built from the grid hierarchy without reading data
+        uncovered = np.nonzero(grid.child_mask)
+        if len(uncovered[0]) == 0:
+            boxes.append(None)
+        else:
+            boxes.append(
+                (
+                    np.array([np.min(idx) for idx in uncovered]),
+                    np.array([np.max(idx) + 1 for idx in uncovered]),
+                )
+            )
+
+    return boxes
+
+
+def get_neighbor_bounds(ds, mins, maxs, n_zones=1):
+    """Widen the grid bounds to include every grid touching its ghost zones."""
+    left_edges = np.asarray(ds.index.grid_left_edge)
+    right_edges = np.asarray(ds.index.grid_right_edge)
+    dds = (right_edges - left_edges) / ds.index.grid_dimensions
+
+    nb_mins = np.empty_like(mins)
+    nb_maxs = np.empty_like(maxs)
+    for igrid in range(len(mins)):
+        # Find all grids that overlap the grid expanded by the ghost zones
+        left = left_edges[igrid] - n_zones * dds[igrid]
+        right = right_edges[igrid] + n_zones * dds[igrid]
+        touching = np.all((left_edges < right) & (right_edges > left), axis=1)
+        # Unknown bounds propagate as NaN so the grid is never culled
+        nb_mins[igrid] = np.min(mins[touching])
+        nb_maxs[igrid] = np.max(maxs[touching])
+
+    return nb_mins, nb_maxs
+
+
+def load_bounds_index(fname, ds):
+    """Load per-grid field bounds from a sidecar index if it matches the dataset."""
+    if not os.path.exists(fname):
+        return None
+
+    with np.load(fname) as data:
+        # Only trust the index if it describes the same grid layout
+        if not np.array_equal(data["grid_dimensions"], ds.index.grid_dimensions):
+            return None
+        return data["mins"], data["maxs"]
+
+
+def save_bounds_index(fname, ds, mins, maxs):
+    """Save per-grid field bounds to a sidecar index for later runs."""
+    np.savez(
+        fname,
+        grid_dimensions=ds.index.grid_dimensions,
+        mins=mins,
+        maxs=maxs,
+    )
@@ -84,6 +84,9 @@ class ytArgs:
             opts = action.option_strings
             if (opts and opts[0] == arg) or action.dest == arg:
                 self.parser._remove_action(action)
+                # Free the option strings so the argument can be added again
+                for opt in opts:
+                    self.parser._option_string_actions.pop(opt, None)
                 break
 
         for action in self.parser._action_groups:
@@ -175,6 +178,20 @@ class ytArgs:
                 "default": 0.0,
                 "help": "Amount to offset center to avoid grid alignment vis issues.",
             },
+            "off_axis": {
+                "type": float,
+                "nargs": 3,
+                "required": False,
+                "default": None,
+                "help": "Normal vector of an off-axis slice (overrides normal).",
+            },
+            "north": {
+                "type": float,
+                "nargs": 3,
+                "required": False,
+                "default": None,
+                "help": "Vector pointing up in an off-axis slice.",
+            },
         }
 
         # Add arguments from dict to parser
@@ -362,6 +379,37 @@ class ytExtractArgs(ytArgs):
                 "default": None,
                 "help": "Choice to extract the gradient of the input field.",
             },
+            "batch": {
+                "action": "store_true",
+                "help": "Flag to extract all of the slices in one pass over the grids.",
+            },
+            "format": {
+                "type": str,
+                "choices": ["npy", "npz"],
+                "required": False,
+                "default": "npy",
+                "help": "Output format (npy with a json sidecar or pickled npz).",
+            },
+            "series": {
+                "type": str,
+                "required": False,
+                "default": None,
+                "help": "Name of a single hdf5 store to append every slice to.",
+            },
+            "amr": {
+                "action": "store_true",
+                "help": "Flag to store each slice as its native AMR patches.",
+            },
+        }
+
+        # Replace the single field from the base class with a list of fields
+        self.remove_arg("field")
+        args["field"] = {
+            "type": str,
+            "nargs": "+",
+            "required": False,
+            "default": None,
+            "help": "Name(s) of the field to extract on each slice.",
         }
 
         # Add arguments from dict to parser
@@ -373,7 +421,8 @@ class ytExtractArgs(ytArgs):
         val_args = {
             "value": {
                 "type": float,
-                "help": "Value of the iso surface to extract.",
+                "nargs": "+",
+                "help": "Value(s) of the iso surface to extract.",
             },
             "vfunction": {
                 "type": float,
@@ -403,9 +452,22 @@ class ytExtractArgs(ytArgs):
                 "action": "store_true",
                 "help": "Flag to get ghost cells before the iso-surface extraction.",
             },
+            "ghost_fill": {
+                "type": str,
+                "choices": ["neighbor", "covering"],
+                "required": False,
+                "default": "neighbor",
+                "help": (
+                    "Fill ghost cells from same-level neighboring grids or from a "
+                    "covering grid."
+                ),
+            },
             "single_level": {
                 "action": "store_true",
-                "help": "Flag to only get single grid level for isosurface.",
+                "help": (
+                    "Deprecated and ignored, ghost zones are always filled on the "
+                    "level of each grid."
+                ),
             },
             "smooth": {
                 "type": float,
@@ -413,6 +475,12 @@ class ytExtractArgs(ytArgs):
                 "default": None,
                 "help": "Smoothing value to apply to field before isosurface extract",
             },
+            "weld": {
+                "type": float,
+                "required": False,
+                "default": None,
+                "help": "Tolerance to merge coincident vertices of the hdf5 mesh.",
+            },
             "iso_edge": {
                 "type": float,
                 "nargs": "+",
@@ -427,6 +495,97 @@ class ytExtractArgs(ytArgs):
                 "default": None,
                 "help": "Choice to extract the gradient of the input field.",
             },
+            "parallel_write": {
+                "action": "store_true",
+                "help": (
+                    "Flag to have each rank write its part of the hdf5 mesh "
+                    "instead of gathering to the root."
+                ),
+            },
+            "partition": {
+                "type": str,
+                "choices": ["round_robin", "lpt", "sfc"],
+                "required": False,
+                "default": "lpt",
+                "help": "Method to distribute the grids across ranks by cost.",
+            },
+            "group_size": {
+                "type": int,
+                "required": False,
+                "default": None,
+                "help": (
+                    "Number of ranks working on each plt file, so several files are "
+                    "processed at once (defaults to all ranks)."
+                ),
+            },
+            "series": {
+                "type": str,
+                "required": False,
+                "default": None,
+                "help": (
+                    "Name of a single hdf5 store and temporal xdmf to append every "
+                    "step to (resumes an interrupted run)."
+                ),
+            },
+            "coord_precision": {
+                "type": int,
+                "choices": [4, 8],
+                "required": False,
+                "default": 8,
+                "help": "Bytes per coordinate in the hdf5 mesh (4 = float32).",
+            },
+            "compression": {
+                "type": str,
+                "choices": ["gzip", "lzf"],
+                "required": False,
+                "default": None,
+                "help": "Compression filter for the chunked hdf5 datasets.",
+            },
+            "shuffle": {
+                "action": "store_true",
+                "help": "Flag to apply the shuffle filter to the hdf5 datasets.",
+            },
+            "quantize": {
+                "type": int,
+                "required": False,
+                "default": None,
+                "help": "Number of decimal digits to keep in the sampled field.",
+            },
+            "level_aware": {
+                "action": "store_true",
+                "help": "Flag to only read grid cells not covered by finer levels.",
+            },
+            "volume": {
+                "action": "store_true",
+                "help": "Flag to also compute the volume above each iso value.",
+            },
+            "stats": {
+                "type": str,
+                "required": False,
+                "default": None,
+                "help": "Name of a time series table to save surface diagnostics to.",
+            },
+            "no_cull": {
+                "action": "store_true",
+                "help": "Flag to disable skipping grids that cannot contain the value.",
+            },
+            "bounds_index": {
+                "action": "store_true",
+                "help": (
+                    "Flag to save/load the per-grid field bounds in a sidecar file "
+                    "under outpath."
+                ),
+            },
+        }
+
+        # Replace the single field from the base class with a list of fields
+        self.remove_arg("field")
+        args["field"] = {
+            "type": str,
+            "nargs": "+",
+            "required": False,
+            "default": None,
+            "help": "Name(s) of the field for the iso surface.",
         }
 
         # Add arguments from dict to parser
@@ -470,6 +629,57 @@ class ytExtractArgs(ytArgs):
                 "action": "store_true",
                 "help": "Flag to explicitly remove all data in EB regions.",
             },
+            "stats": {
+                "type": str,
+                "nargs": "+",
+                "choices": ["mean", "min", "max", "var", "rms", "favre"],
+                "required": False,
+                "default": ["mean"],
+                "help": "Statistics of each field to extract (volume weighted).",
+            },
+            "density": {
+                "type": str,
+                "required": False,
+                "default": "density",
+                "help": "Name of the density field for Favre averages.",
+            },
+            "incremental": {
+                "action": "store_true",
+                "help": "Flag to only process the plot files missing from the store.",
+            },
+            "condition": {
+                "type": str,
+                "required": False,
+                "default": None,
+                "help": "Name of the field to condition binned statistics on.",
+            },
+            "condition_range": {
+                "type": float,
+                "nargs": 2,
+                "required": False,
+                "default": None,
+                "help": "Range of the condition field to bin (min, max).",
+            },
+            "nbins": {
+                "type": int,
+                "required": False,
+                "default": 32,
+                "help": "Number of bins of the condition (and joint) fields.",
+            },
+            "joint": {
+                "type": str,
+                "nargs": "+",
+                "required": False,
+                "default": None,
+                "help": "Fields for joint PDFs with the condition [FIELD, MIN, MAX].",
+            },
+            "profile": {
+                "type": str,
+                "choices": ["x", "y", "z"],
+                "required": False,
+                "default": None,
+                "help": "Direction of planar (or line, with normal) averaged profiles.",
+            },
         }
 
         # Add arguments from dict to parser